@@ -1,8 +1,24 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
+
 import gdown
 
 FOLDER_URL = "https://drive.google.com/drive/folders/1TGEc66YKbD443nslRi1bWgVd238gJCnb"
 OUTPUT_DIR = r"C:\Users\rattu\Downloads\Target SQL\data"
+MAX_WORKERS = 8
+
+
+def download_file(entry):
+    # Each file is an independent request, so these run side by side
+    os.makedirs(os.path.dirname(entry.local_path), exist_ok=True)
+    gdown.download(
+        id=entry.id,
+        output=entry.local_path,
+        quiet=True,
+        use_cookies=False,
+    )
+    return os.path.basename(entry.local_path)
+
 
 def main():
     os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -10,33 +26,38 @@ def main():
     print(f"Downloading all files from:\n  {FOLDER_URL}")
     print(f"Saving into:\n  {OUTPUT_DIR}\n")
 
-    # Download every file from the Drive folder
-    gdown.download_folder(
+    # List the Drive folder without downloading anything yet
+    entries = gdown.download_folder(
         url=FOLDER_URL,
         output=OUTPUT_DIR,
-        quiet=False,
+        quiet=True,
         use_cookies=False,
+        skip_download=True,
     )
-
-    # Keep only CSVs
-    kept, removed = [], []
-    for fname in os.listdir(OUTPUT_DIR):
-        full_path = os.path.join(OUTPUT_DIR, fname)
-        if os.path.isfile(full_path):
-            if fname.lower().endswith(".csv"):
-                kept.append(fname)
-            else:
-                os.remove(full_path)
-                removed.append(fname)
+    # gdown returns None when it cannot list the folder (private folder,
+    # bad URL, Drive rate limiting) instead of raising
+    if not entries:
+        raise SystemExit(
+            f"Could not list the Drive folder:\n  {FOLDER_URL}\n"
+            "Check that it is shared publicly and try again later."
+        )
+
+    # Keep only CSVs; everything else is never fetched
+    csv_entries = [e for e in entries if e.path.lower().endswith(".csv")]
+    skipped = [os.path.basename(e.path) for e in entries if e not in csv_entries]
+
+    # Download every CSV concurrently
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        kept = list(pool.map(download_file, csv_entries))
 
     print("\nCSV files downloaded:")
     for k in kept:
         print("  -", k)
 
-    if removed:
-        print("\nNon-CSV files removed:")
-        for r in removed:
-            print("  -", r)
+    if skipped:
+        print("\nNon-CSV files skipped:")
+        for s in skipped:
+            print("  -", s)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,43 +1,131 @@
 import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import duckdb
+import pyarrow.csv
+import pyarrow.parquet
 
 
 BASE_DIR = Path(__file__).parent
-DATA_DIR = BASE_DIR / "Target- SQL Business Case ALL 8 CSV"
+# CSV location, overridable through TARGET_DATA_DIR (Streamlit also exports
+# root-level keys from .streamlit/secrets.toml into the environment)
+DATA_DIR = Path(
+    os.environ.get("TARGET_DATA_DIR", BASE_DIR / "Target- SQL Business Case ALL 8 CSV")
+)
 OUTPUT_DIR = BASE_DIR / "outputs"
+# Persistent databases reused across runs (see init_db). The dashboard and
+# this script each keep their own file, since DuckDB lets only one process
+# hold a database open for writing and the reports create tables as they run.
+DB_PATH = BASE_DIR / "target.duckdb"
+REPORTS_DB_PATH = BASE_DIR / "target_reports.duckdb"
 
+# Number of files converted / loaded at the same time
+LOAD_WORKERS = 4
+# Number of report queries run at the same time (see run_all)
+QUERY_WORKERS = 4
 
-def init_db() -> duckdb.DuckDBPyConnection:
+# DuckDB resource settings, overridable through the environment
+DUCKDB_THREADS = int(os.environ.get("DUCKDB_THREADS", os.cpu_count() or 1))
+DUCKDB_MEMORY_LIMIT = os.environ.get("DUCKDB_MEMORY_LIMIT", "8GB")
+# Large joins / group-bys spill here instead of failing at the memory limit
+DUCKDB_TEMP_DIR = Path(
+    os.environ.get("DUCKDB_TEMP_DIR", Path(tempfile.gettempdir()) / "duckdb_spill")
+)
+
+
+# Map logical table names → CSV file names
+CSV_MAP = {
+    "customers": "customers.csv",
+    "sellers": "sellers.csv",
+    "order_items": "order_items.csv",
+    "geolocation": "geolocation.csv",
+    "payments": "payments.csv",
+    # The SQL uses table name `reviews`, CSV is `order_reviews.csv`
+    "reviews": "order_reviews.csv",
+    "orders": "orders.csv",
+    "products": "products.csv",
+}
+
+# Columns loaded into DuckDB per table; anything else stays in the Parquet
+# copies. Covers both this script and streamlit_app.py (which only needs
+# seller_id to count sellers). geolocation is not queried, so it isn't loaded.
+USED_COLUMNS = {
+    "orders": [
+        "order_id",
+        "customer_id",
+        "order_status",
+        "order_purchase_timestamp",
+        "order_delivered_customer_date",
+        "order_estimated_delivery_date",
+    ],
+    "order_items": ["order_id", "order_item_id", "product_id", "price", "freight_value"],
+    "payments": ["order_id", "payment_type", "payment_installments", "payment_value"],
+    "customers": ["customer_id", "customer_city", "customer_state"],
+    "reviews": ["review_score"],
+    "products": ["product_id", "product category"],
+    "sellers": ["seller_id"],
+}
+
+# Narrower types than read_csv_auto picks (BIGINT / DOUBLE). Scores and
+# installments are small integers and money values have two decimals, so
+# nothing is lost; DECIMAL(9, 2) is stored as a 4-byte integer.
+COLUMN_TYPES = {
+    "review_score": "TINYINT",
+    "payment_installments": "TINYINT",
+    "payment_value": "DECIMAL(9, 2)",
+    "price": "DECIMAL(9, 2)",
+    "freight_value": "DECIMAL(9, 2)",
+}
+
+# Low-cardinality strings converted to ENUMs (1-byte codes) after loading
+ENUM_COLUMNS = {
+    "customers": ["customer_state"],
+    "orders": ["order_status"],
+}
+
+
+def parquet_path(table: str) -> Path:
+    """Location of the Parquet copy of a table's CSV (see materialize_parquet)."""
+    return DATA_DIR / "parquet" / f"{table}.parquet"
+
+
+def execute_parallel(con: duckdb.DuckDBPyConnection, statements: list) -> None:
     """
-    Initialise an in-memory DuckDB database and register all CSVs as views
-    that match the table names used in Target_SQL_Queries.sql.
+    Execute independent statements concurrently, each on its own cursor of
+    `con`, so file I/O for one statement overlaps with parsing for another.
     """
-    con = duckdb.connect(database=":memory:")
+    def _execute(sql: str) -> None:
+        with con.cursor() as cur:
+            cur.execute(sql)
 
-    # Ensure paths exist
-    if not DATA_DIR.exists():
-        raise FileNotFoundError(f"Data directory not found: {DATA_DIR}")
+    with ThreadPoolExecutor(max_workers=LOAD_WORKERS) as pool:
+        # list() so an exception in any worker is raised here
+        list(pool.map(_execute, statements))
 
-    # Map logical table names → CSV file names
-    csv_map = {
-        "customers": "customers.csv",
-        "sellers": "sellers.csv",
-        "order_items": "order_items.csv",
-        "geolocation": "geolocation.csv",
-        "payments": "payments.csv",
-        # The SQL uses table name `reviews`, CSV is `order_reviews.csv`
-        "reviews": "order_reviews.csv",
-        "orders": "orders.csv",
-        "products": "products.csv",
-    }
 
-    for table, filename in csv_map.items():
+def materialize_parquet(con: duckdb.DuckDBPyConnection) -> dict:
+    """
+    Convert each CSV in CSV_MAP to a Zstd-compressed Parquet file under
+    DATA_DIR/parquet, skipping files whose Parquet copy is already newer than
+    the CSV. Returns a mapping of table name → Parquet path.
+    """
+    (DATA_DIR / "parquet").mkdir(exist_ok=True, parents=True)
+
+    parquet_paths = {}
+    statements = []
+    for table, filename in CSV_MAP.items():
         csv_path = DATA_DIR / filename
         if not csv_path.exists():
             raise FileNotFoundError(f"Expected CSV not found: {csv_path}")
 
+        pq_path = parquet_path(table)
+        parquet_paths[table] = pq_path
+        if pq_path.exists() and os.path.getmtime(pq_path) >= os.path.getmtime(csv_path):
+            continue
+
         # Some files (e.g. order_reviews.csv) are not UTF-8 encoded and can trigger
         # unicode errors. For robustness, allow DuckDB to skip problematic rows
         # using ignore_errors=true.
@@ -46,39 +134,361 @@ def init_db() -> duckdb.DuckDBPyConnection:
         else:
             read_opts = ", header=True"
 
-        # Create a view so we can query with simple table names
-        con.execute(
+        statements.append(
             f"""
-            CREATE OR REPLACE VIEW {table} AS
-            SELECT * FROM read_csv_auto('{csv_path.as_posix()}'{read_opts});
+            COPY (
+                SELECT * FROM read_csv_auto('{csv_path.as_posix()}'{read_opts})
+            ) TO '{pq_path.as_posix()}' (FORMAT PARQUET, COMPRESSION ZSTD);
             """
         )
 
+    execute_parallel(con, statements)
+    return parquet_paths
+
+
+def connect(db_path: Path, read_only: bool = False) -> duckdb.DuckDBPyConnection:
+    """
+    Open the database at db_path with the DUCKDB_* resource settings applied.
+    A read-only handle takes a shared lock, so several processes can read the
+    file at once as long as none of them has it open for writing.
+    """
+    con = duckdb.connect(database=str(db_path), read_only=read_only)
+    con.execute(f"PRAGMA threads={DUCKDB_THREADS}")
+    con.execute(f"PRAGMA memory_limit='{DUCKDB_MEMORY_LIMIT}'")
+    con.execute(f"PRAGMA temp_directory='{DUCKDB_TEMP_DIR.as_posix()}'")
+    # Reuse Parquet metadata across queries; no progress bar on stderr
+    con.execute("PRAGMA enable_object_cache")
+    con.execute("PRAGMA disable_progress_bar")
     return con
 
 
-def run_and_save(con: duckdb.DuckDBPyConnection, name: str, sql: str) -> None:
+def expected_loads() -> dict:
     """
-    Run a query and save the full result to a CSV in OUTPUT_DIR.
-    Also save the first 10 rows as a preview CSV.
+    Table name → (CSV modification time, SELECT list) for each table in
+    USED_COLUMNS, as recorded in the `_loads` table once it is loaded.
     """
-    OUTPUT_DIR.mkdir(exist_ok=True, parents=True)
+    loads = {}
+    for table, columns in USED_COLUMNS.items():
+        cols = ", ".join(
+            f'CAST("{c}" AS {COLUMN_TYPES[c]}) AS "{c}"' if c in COLUMN_TYPES else f'"{c}"'
+            for c in columns
+        )
+        loads[table] = (os.path.getmtime(DATA_DIR / CSV_MAP[table]), cols)
+    return loads
 
-    result = con.execute(sql).fetch_df()
+
+def has_misbucketed_hours(con: duckdb.DuckDBPyConnection) -> bool:
+    """
+    True if orders has a time_of_day for a NULL purchase hour. Databases
+    built before NULL hours were kept NULL stored 'Dawn' there, and the
+    column is otherwise only recomputed when orders is reloaded.
+    """
+    return con.execute(
+        "SELECT EXISTS (SELECT 1 FROM orders WHERE order_hour IS NULL AND time_of_day IS NOT NULL)"
+    ).fetchone()[0]
+
+
+def is_current(con: duckdb.DuckDBPyConnection) -> bool:
+    """True if init_db would have nothing to load into con's database."""
+    try:
+        loads = {
+            table: (mtime, columns)
+            for table, mtime, columns in con.execute("SELECT * FROM _loads").fetchall()
+        }
+        orders_columns = {row[0] for row in con.execute("DESCRIBE orders").fetchall()}
+    except duckdb.CatalogException:
+        return False
+    existing = {row[0] for row in con.execute("SHOW TABLES").fetchall()}
+    return (
+        "time_of_day" in orders_columns
+        and all(
+            table in existing and loads.get(table) == current
+            for table, current in expected_loads().items()
+        )
+        and not has_misbucketed_hours(con)
+    )
+
+
+def publish_db(db_path: Path) -> None:
+    """
+    Bring the database at db_path up to date without ever opening it for
+    writing, so processes reading it are never locked out.
+
+    If it is already current nothing is written. Otherwise a copy is
+    brought up to date with init_db under a per-process staging name and
+    renamed over db_path. Readers that already have the old file open
+    keep reading it until they reconnect.
+    """
+    if db_path.exists():
+        con = connect(db_path, read_only=True)
+        try:
+            if is_current(con):
+                return
+        finally:
+            con.close()
+
+    staging = db_path.with_name(f"{db_path.name}.{os.getpid()}.tmp")
+    try:
+        if db_path.exists():
+            # Start from the current file so only stale tables are reloaded
+            shutil.copyfile(db_path, staging)
+        init_db(staging).close()
+        os.replace(staging, db_path)
+    finally:
+        staging.unlink(missing_ok=True)
+        Path(f"{staging}.wal").unlink(missing_ok=True)
+
+
+def init_db(db_path: Path) -> duckdb.DuckDBPyConnection:
+    """
+    Open the persistent DuckDB database at db_path and make sure each table in
+    USED_COLUMNS is loaded, under the table names used in
+    Target_SQL_Queries.sql.
+
+    The CSVs are converted to Parquet once (see materialize_parquet) and loaded
+    from there, with the types in COLUMN_TYPES and ENUM_COLUMNS. A `_loads`
+    table records the CSV modification time and column list each table was
+    loaded with; tables whose entry still matches are kept
+    as they are, so after the first run opening the database is nearly free.
+    """
+    con = connect(db_path)
+
+    # Ensure paths exist
+    if not DATA_DIR.exists():
+        raise FileNotFoundError(f"Data directory not found: {DATA_DIR}")
+
+    parquet_paths = materialize_parquet(con)
+
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS _loads (
+            table_name   VARCHAR PRIMARY KEY,
+            source_mtime DOUBLE,
+            columns      VARCHAR
+        );
+        """
+    )
+    loads = {
+        table: (mtime, columns)
+        for table, mtime, columns in con.execute("SELECT * FROM _loads").fetchall()
+    }
+    existing = {row[0] for row in con.execute("SHOW TABLES").fetchall()}
+
+    statements = []
+    reloaded = []
+    for table, current in expected_loads().items():
+        if table in existing and loads.get(table) == current:
+            continue
+        cols = current[1]
+
+        pq_path = parquet_paths[table]
+        # Load into a table so the queries don't re-read the file each time
+        statements.append(
+            f"""
+            CREATE OR REPLACE TABLE {table} AS
+            SELECT {cols} FROM read_parquet('{pq_path.as_posix()}');
+            """
+        )
+        reloaded.append((table, *current))
+    execute_parallel(con, statements)
+
+    reloaded_tables = [table for table, _, _ in reloaded]
+    for table in reloaded_tables:
+        for column in ENUM_COLUMNS.get(table, []):
+            # Sorted values, so ORDER BY on the ENUM matches the string order
+            enum_type = f"{column}_t"
+            con.execute(
+                f"""
+                DROP TYPE IF EXISTS {enum_type};
+                CREATE TYPE {enum_type} AS ENUM (
+                    SELECT DISTINCT {column} FROM {table}
+                    WHERE {column} IS NOT NULL
+                    ORDER BY {column}
+                );
+                ALTER TABLE {table} ALTER {column} SET DATA TYPE {enum_type};
+                """
+            )
+
+    orders_columns = {row[0] for row in con.execute("DESCRIBE orders").fetchall()}
+    if (
+        "orders" in reloaded_tables
+        or "time_of_day" not in orders_columns
+        or has_misbucketed_hours(con)
+    ):
+        # Decompose the purchase timestamp once so the queries group on plain
+        # columns instead of calling EXTRACT / CASE per row.
+        # time_of_day: 0-6 Dawn, 7-12 Morning, 13-18 Afternoon, 19-23 Night;
+        # GREATEST(hour - 1, 0) // 6 maps those ranges to 0..3. GREATEST
+        # skips NULLs, so a NULL hour is kept NULL explicitly (own group in 2_3)
+        con.execute(
+            """
+            ALTER TABLE orders ADD COLUMN IF NOT EXISTS order_year SMALLINT;
+            ALTER TABLE orders ADD COLUMN IF NOT EXISTS order_month TINYINT;
+            ALTER TABLE orders ADD COLUMN IF NOT EXISTS order_hour TINYINT;
+            ALTER TABLE orders ADD COLUMN IF NOT EXISTS time_of_day VARCHAR;
+            UPDATE orders SET
+                order_year  = EXTRACT(year  FROM order_purchase_timestamp),
+                order_month = EXTRACT(month FROM order_purchase_timestamp),
+                order_hour  = EXTRACT(hour  FROM order_purchase_timestamp);
+            UPDATE orders SET
+                time_of_day = CASE
+                    WHEN order_hour IS NULL THEN NULL
+                    ELSE ['Dawn', 'Morning', 'Afternoon', 'Night'][GREATEST(order_hour - 1, 0) // 6 + 1]
+                END;
+            """
+        )
+
+    if reloaded:
+        con.executemany("INSERT OR REPLACE INTO _loads VALUES (?, ?, ?)", reloaded)
+
+    return con
+
+
+def run_and_save(con: duckdb.DuckDBPyConnection, name: str, sql: str) -> tuple:
+    """
+    Run a query and save the full result to a Zstd-compressed Parquet file in
+    OUTPUT_DIR. Also save the first 10 rows as a human-readable preview CSV.
+    Returns the full result's path and row count.
+
+    The query runs once into an Arrow table, which pyarrow writes directly;
+    the preview is a zero-copy slice of the same table.
+    """
+    OUTPUT_DIR.mkdir(exist_ok=True, parents=True)
 
     safe_name = name.replace(" ", "_").replace(".", "_")
-    full_path = OUTPUT_DIR / f"{safe_name}.csv"
+    full_path = OUTPUT_DIR / f"{safe_name}.parquet"
     preview_path = OUTPUT_DIR / f"{safe_name}_preview10.csv"
 
-    result.to_csv(full_path, index=False)
+    result = con.execute(sql).to_arrow_table()
+
+    pyarrow.parquet.write_table(result, full_path, compression="zstd")
     # Save first 10 rows as preview
-    result.head(10).to_csv(preview_path, index=False)
+    pyarrow.csv.write_csv(result.slice(0, 10), preview_path)
+
+    return full_path, result.num_rows
+
+
+def materialize(con: duckdb.DuckDBPyConnection, name: str, sql: str) -> None:
+    """
+    Store an intermediate result as a table so several queries can read it
+    without repeating the underlying joins. Nothing is written to OUTPUT_DIR.
+
+    A regular (not TEMP) table is used because temp tables are only visible to
+    the connection that created them, and the queries run on separate cursors.
+    """
+    con.execute(f"CREATE OR REPLACE TABLE {name} AS {sql}")
+
+
+def run_all(con: duckdb.DuckDBPyConnection, queries: list) -> None:
+    """
+    Run the (name, sql) queries concurrently, each on its own cursor of `con`.
+    DuckDB's thread count is divided between the workers for the duration so
+    the pool and DuckDB's own parallelism don't oversubscribe the cores.
+    """
+    def _run(query: tuple) -> tuple:
+        with con.cursor() as cur:
+            return run_and_save(cur, *query)
+
+    con.execute(f"SET threads = {max(1, DUCKDB_THREADS // QUERY_WORKERS)}")
+    try:
+        with ThreadPoolExecutor(max_workers=QUERY_WORKERS) as pool:
+            results = list(pool.map(_run, queries))
+    finally:
+        con.execute(f"SET threads = {DUCKDB_THREADS}")
 
-    print(f"[OK] {name} -> {full_path.name} (rows={len(result)})")
+    # Report in query order once everything has been written
+    for (name, _), (full_path, rows) in zip(queries, results):
+        print(f"[OK] {name} -> {full_path.name} (rows={rows})")
 
 
 def main() -> None:
-    con = init_db()
+    try:
+        con = init_db(REPORTS_DB_PATH)
+    except duckdb.IOException as e:
+        # Only one process may have the file open for writing at a time
+        raise SystemExit(
+            f"Could not open {REPORTS_DB_PATH}: it is locked by another process, "
+            f"most likely a run_target_queries.py that is still running. Wait for "
+            f"it to finish and run again.\n({e})"
+        )
+
+    # Intermediate results shared by several queries below
+    shared = [
+        # orders joined with the customer's location, used by every
+        # per-state / per-city query instead of repeating the join
+        (
+            "orders_c",
+            """
+            SELECT o.*, c.customer_city, c.customer_state
+            FROM orders o
+            INNER JOIN customers c ON o.customer_id = c.customer_id;
+            """,
+        ),
+        # Order counts per purchase (year, month, hour); SECTION 2 rolls this
+        # up instead of scanning orders three times
+        (
+            "_orders_bucketed",
+            """
+            SELECT
+                order_year,
+                order_month,
+                order_hour,
+                time_of_day,
+                COUNT(*) AS n
+            FROM orders
+            GROUP BY order_year, order_month, order_hour, time_of_day;
+            """,
+        ),
+        # Distinct orders per (year, month, payment type) and per installment
+        # count from one scan of payments. The LEFT JOIN keeps payments whose
+        # order is missing for the installments set; 6_1 counts only matched
+        # orders (matched_order_count), which keeps orders with a NULL
+        # purchase timestamp as a NULL-year group like an inner join would.
+        (
+            "_payment_counts",
+            """
+            SELECT
+                o.order_year,
+                o.order_month,
+                p.payment_type,
+                p.payment_installments,
+                GROUPING(p.payment_installments) = 0 AS by_installments,
+                COUNT(DISTINCT p.order_id) AS order_count,
+                COUNT(DISTINCT o.order_id) AS matched_order_count
+            FROM payments p
+            LEFT JOIN orders o ON p.order_id = o.order_id
+            GROUP BY GROUPING SETS (
+                (o.order_year, o.order_month, p.payment_type),
+                (p.payment_installments)
+            );
+            """,
+        ),
+        # Per-state aggregates shared by the highest/lowest pairs in SECTION 5
+        (
+            "_state_freight",
+            """
+            SELECT
+                o.customer_state,
+                AVG(oi.freight_value) AS avg_freight_value
+            FROM orders_c o
+            INNER JOIN order_items oi ON o.order_id = oi.order_id
+            GROUP BY o.customer_state;
+            """,
+        ),
+        (
+            "_state_delivery",
+            """
+            SELECT
+                o.customer_state,
+                AVG(date_diff('day', o.order_purchase_timestamp, o.order_delivered_customer_date)) AS avg_delivery_time
+            FROM orders_c o
+            WHERE o.order_delivered_customer_date IS NOT NULL
+            GROUP BY o.customer_state;
+            """,
+        ),
+    ]
+    for name, sql in shared:
+        materialize(con, name, sql)
 
     # SECTION 1
     queries = [
@@ -98,10 +508,9 @@ def main() -> None:
             "1_3_customer_cities_states",
             """
             SELECT
-                COUNT(DISTINCT c.customer_city) AS total_cities,
-                COUNT(DISTINCT c.customer_state) AS total_states
-            FROM customers c
-            INNER JOIN orders o ON c.customer_id = o.customer_id;
+                COUNT(DISTINCT o.customer_city) AS total_cities,
+                COUNT(DISTINCT o.customer_state) AS total_states
+            FROM orders_c o;
             """,
         ),
         # SECTION 2
@@ -110,21 +519,25 @@ def main() -> None:
             """
             WITH yearly AS (
                 SELECT
-                    EXTRACT(year FROM order_purchase_timestamp) AS order_year,
-                    COUNT(*) AS total_orders
-                FROM orders
+                    order_year,
+                    SUM(n)::BIGINT AS total_orders
+                FROM _orders_bucketed
                 GROUP BY order_year
+            ),
+            with_lag AS (
+                SELECT
+                    order_year,
+                    total_orders,
+                    LAG(total_orders) OVER (ORDER BY order_year) AS previous_year_orders
+                FROM yearly
             )
             SELECT
                 order_year,
                 total_orders,
-                LAG(total_orders) OVER (ORDER BY order_year) AS previous_year_orders,
-                CASE
-                    WHEN LAG(total_orders) OVER (ORDER BY order_year) IS NULL THEN NULL
-                    ELSE (total_orders - LAG(total_orders) OVER (ORDER BY order_year))
-                         * 100.0 / LAG(total_orders) OVER (ORDER BY order_year)
-                END AS year_over_year_growth_pct
-            FROM yearly
+                previous_year_orders,
+                (total_orders - previous_year_orders) * 100.0
+                    / NULLIF(previous_year_orders, 0) AS year_over_year_growth_pct
+            FROM with_lag
             ORDER BY order_year;
             """,
         ),
@@ -132,10 +545,10 @@ def main() -> None:
             "2_2_monthly_seasonality",
             """
             SELECT
-                EXTRACT(year  FROM order_purchase_timestamp) AS order_year,
-                EXTRACT(month FROM order_purchase_timestamp) AS order_month,
-                COUNT(*) AS total_orders
-            FROM orders
+                order_year,
+                order_month,
+                SUM(n)::BIGINT AS total_orders
+            FROM _orders_bucketed
             GROUP BY order_year, order_month
             ORDER BY order_year, order_month;
             """,
@@ -143,21 +556,11 @@ def main() -> None:
         (
             "2_3_time_of_day_distribution",
             """
-            WITH classified AS (
-                SELECT
-                    CASE
-                        WHEN EXTRACT(hour FROM order_purchase_timestamp) BETWEEN 0 AND 6  THEN 'Dawn'
-                        WHEN EXTRACT(hour FROM order_purchase_timestamp) BETWEEN 7 AND 12 THEN 'Morning'
-                        WHEN EXTRACT(hour FROM order_purchase_timestamp) BETWEEN 13 AND 18 THEN 'Afternoon'
-                        WHEN EXTRACT(hour FROM order_purchase_timestamp) BETWEEN 19 AND 23 THEN 'Night'
-                    END AS time_of_day
-                FROM orders
-            )
             SELECT
                 time_of_day,
-                COUNT(*) AS order_count,
-                ROUND(COUNT(*) * 100.0 / SUM(COUNT(*)) OVER (), 2) AS percentage
-            FROM classified
+                SUM(n)::BIGINT AS order_count,
+                ROUND(SUM(n) * 100.0 / SUM(SUM(n)) OVER (), 2) AS percentage
+            FROM _orders_bucketed
             GROUP BY time_of_day
             ORDER BY order_count DESC;
             """,
@@ -167,14 +570,13 @@ def main() -> None:
             "3_1_month_on_month_orders_by_state",
             """
             SELECT
-                c.customer_state,
-                EXTRACT(year  FROM o.order_purchase_timestamp) AS order_year,
-                EXTRACT(month FROM o.order_purchase_timestamp) AS order_month,
+                o.customer_state,
+                o.order_year,
+                o.order_month,
                 COUNT(*) AS total_orders
-            FROM orders o
-            INNER JOIN customers c ON o.customer_id = c.customer_id
-            GROUP BY c.customer_state, order_year, order_month
-            ORDER BY c.customer_state, order_year, order_month;
+            FROM orders_c o
+            GROUP BY o.customer_state, o.order_year, o.order_month
+            ORDER BY o.customer_state, o.order_year, o.order_month;
             """,
         ),
         (
@@ -201,38 +603,30 @@ def main() -> None:
             """
             WITH OrderCosts AS (
                 SELECT
-                    EXTRACT(year FROM o.order_purchase_timestamp) AS order_year,
-                    SUM(p.payment_value) AS total_cost
+                    SUM(p.payment_value) FILTER (WHERE o.order_year = 2018) AS cost_2018,
+                    SUM(p.payment_value) FILTER (WHERE o.order_year = 2017) AS cost_2017
                 FROM orders o
                 INNER JOIN payments p ON o.order_id = p.order_id
-                WHERE EXTRACT(year FROM o.order_purchase_timestamp) IN (2017, 2018)
-                  AND EXTRACT(month FROM o.order_purchase_timestamp) BETWEEN 1 AND 8
-                GROUP BY order_year
+                WHERE o.order_year IN (2017, 2018)
+                  AND o.order_month BETWEEN 1 AND 8
             )
             SELECT
-                (SELECT total_cost FROM OrderCosts WHERE order_year = 2018) AS cost_2018,
-                (SELECT total_cost FROM OrderCosts WHERE order_year = 2017) AS cost_2017,
-                ROUND(
-                    (
-                        (SELECT total_cost FROM OrderCosts WHERE order_year = 2018) -
-                        (SELECT total_cost FROM OrderCosts WHERE order_year = 2017)
-                    ) * 100.0 /
-                    (SELECT total_cost FROM OrderCosts WHERE order_year = 2017),
-                    2
-                ) AS percentage_increase;
+                cost_2018,
+                cost_2017,
+                ROUND((cost_2018 - cost_2017) * 100.0 / cost_2017, 2) AS percentage_increase
+            FROM OrderCosts;
             """,
         ),
         (
             "4_2_total_avg_order_price_by_state",
             """
             SELECT
-                c.customer_state,
+                o.customer_state,
                 SUM(oi.price) AS total_order_price,
                 AVG(oi.price) AS avg_order_price
-            FROM orders o
-            INNER JOIN customers c ON o.customer_id = c.customer_id
+            FROM orders_c o
             INNER JOIN order_items oi ON o.order_id = oi.order_id
-            GROUP BY c.customer_state
+            GROUP BY o.customer_state
             ORDER BY total_order_price DESC;
             """,
         ),
@@ -240,13 +634,12 @@ def main() -> None:
             "4_3_total_avg_freight_by_state",
             """
             SELECT
-                c.customer_state,
+                o.customer_state,
                 SUM(oi.freight_value) AS total_freight_value,
                 AVG(oi.freight_value) AS avg_freight_value
-            FROM orders o
-            INNER JOIN customers c ON o.customer_id = c.customer_id
+            FROM orders_c o
             INNER JOIN order_items oi ON o.order_id = oi.order_id
-            GROUP BY c.customer_state
+            GROUP BY o.customer_state
             ORDER BY total_freight_value DESC;
             """,
         ),
@@ -269,18 +662,8 @@ def main() -> None:
         (
             "5_2_top5_states_highest_avg_freight",
             """
-            SELECT
-                customer_state,
-                AVG(freight_value) AS avg_freight_value
-            FROM (
-                SELECT
-                    c.customer_state,
-                    oi.freight_value
-                FROM orders o
-                INNER JOIN customers c ON o.customer_id = c.customer_id
-                INNER JOIN order_items oi ON o.order_id = oi.order_id
-            )
-            GROUP BY customer_state
+            SELECT customer_state, avg_freight_value
+            FROM _state_freight
             ORDER BY avg_freight_value DESC
             LIMIT 5;
             """,
@@ -288,18 +671,8 @@ def main() -> None:
         (
             "5_2_top5_states_lowest_avg_freight",
             """
-            SELECT
-                customer_state,
-                AVG(freight_value) AS avg_freight_value
-            FROM (
-                SELECT
-                    c.customer_state,
-                    oi.freight_value
-                FROM orders o
-                INNER JOIN customers c ON o.customer_id = c.customer_id
-                INNER JOIN order_items oi ON o.order_id = oi.order_id
-            )
-            GROUP BY customer_state
+            SELECT customer_state, avg_freight_value
+            FROM _state_freight
             ORDER BY avg_freight_value ASC
             LIMIT 5;
             """,
@@ -307,18 +680,8 @@ def main() -> None:
         (
             "5_3_top5_states_highest_avg_delivery_time",
             """
-            SELECT
-                customer_state,
-                AVG(delivery_days) AS avg_delivery_time
-            FROM (
-                SELECT
-                    c.customer_state,
-                    date_diff('day', o.order_purchase_timestamp, o.order_delivered_customer_date) AS delivery_days
-                FROM orders o
-                INNER JOIN customers c ON o.customer_id = c.customer_id
-                WHERE o.order_delivered_customer_date IS NOT NULL
-            )
-            GROUP BY customer_state
+            SELECT customer_state, avg_delivery_time
+            FROM _state_delivery
             ORDER BY avg_delivery_time DESC
             LIMIT 5;
             """,
@@ -326,18 +689,8 @@ def main() -> None:
         (
             "5_3_top5_states_lowest_avg_delivery_time",
             """
-            SELECT
-                customer_state,
-                AVG(delivery_days) AS avg_delivery_time
-            FROM (
-                SELECT
-                    c.customer_state,
-                    date_diff('day', o.order_purchase_timestamp, o.order_delivered_customer_date) AS delivery_days
-                FROM orders o
-                INNER JOIN customers c ON o.customer_id = c.customer_id
-                WHERE o.order_delivered_customer_date IS NOT NULL
-            )
-            GROUP BY customer_state
+            SELECT customer_state, avg_delivery_time
+            FROM _state_delivery
             ORDER BY avg_delivery_time ASC
             LIMIT 5;
             """,
@@ -350,10 +703,9 @@ def main() -> None:
                 AVG(days_faster) AS avg_days_faster_than_estimated
             FROM (
                 SELECT
-                    c.customer_state,
+                    o.customer_state,
                     date_diff('day', o.order_delivered_customer_date, o.order_estimated_delivery_date) AS days_faster
-                FROM orders o
-                INNER JOIN customers c ON o.customer_id = c.customer_id
+                FROM orders_c o
                 WHERE o.order_delivered_customer_date IS NOT NULL
                   AND o.order_estimated_delivery_date IS NOT NULL
             )
@@ -364,28 +716,23 @@ def main() -> None:
             """,
         ),
         # SECTION 6
+        # Both reports are slices of _payment_counts
         (
             "6_1_monthly_orders_by_payment_type",
             """
-            SELECT
-                EXTRACT(year  FROM o.order_purchase_timestamp) AS order_year,
-                EXTRACT(month FROM o.order_purchase_timestamp) AS order_month,
-                p.payment_type,
-                COUNT(DISTINCT o.order_id) AS order_count
-            FROM orders o
-            INNER JOIN payments p ON o.order_id = p.order_id
-            GROUP BY order_year, order_month, p.payment_type
-            ORDER BY order_year, order_month, p.payment_type;
+            SELECT order_year, order_month, payment_type, matched_order_count AS order_count
+            FROM _payment_counts
+            WHERE NOT by_installments
+              AND matched_order_count > 0
+            ORDER BY order_year, order_month, payment_type;
             """,
         ),
         (
             "6_2_orders_by_installments",
             """
-            SELECT
-                payment_installments,
-                COUNT(DISTINCT order_id) AS order_count
-            FROM payments
-            GROUP BY payment_installments
+            SELECT payment_installments, order_count
+            FROM _payment_counts
+            WHERE by_installments
             ORDER BY payment_installments;
             """,
         ),
@@ -415,29 +762,36 @@ def main() -> None:
                 FROM orders
                 GROUP BY customer_id
             )
+            -- customer_orders has one row per customer_id, so plain counts
+            -- are already distinct
             SELECT
-                COUNT(DISTINCT customer_id) AS total_customers,
-                COUNT(DISTINCT CASE WHEN order_count > 1 THEN customer_id END) AS repeat_customers,
-                ROUND(
-                    COUNT(DISTINCT CASE WHEN order_count > 1 THEN customer_id END) * 100.0 /
-                    COUNT(DISTINCT customer_id),
-                    2
-                ) AS retention_rate
+                COUNT(*) AS total_customers,
+                COUNT(*) FILTER (WHERE order_count > 1) AS repeat_customers,
+                ROUND(COUNT(*) FILTER (WHERE order_count > 1) * 100.0 / COUNT(*), 2) AS retention_rate
             FROM customer_orders;
             """,
         ),
+        # Payments are summed per order before the join, so each order is one
+        # row and total_orders is a plain COUNT(*). avg_order_value keeps its
+        # original meaning (mean over payment rows) via payment_rows.
         (
             "A3_avg_order_value_by_state",
             """
             SELECT
-                c.customer_state,
-                COUNT(DISTINCT o.order_id) AS total_orders,
-                SUM(p.payment_value) AS total_revenue,
-                AVG(p.payment_value) AS avg_order_value
-            FROM orders o
-            INNER JOIN customers c ON o.customer_id = c.customer_id
-            INNER JOIN payments p ON o.order_id = p.order_id
-            GROUP BY c.customer_state
+                o.customer_state,
+                COUNT(*) AS total_orders,
+                SUM(p.order_value) AS total_revenue,
+                SUM(p.order_value) / SUM(p.payment_rows) AS avg_order_value
+            FROM orders_c o
+            INNER JOIN (
+                SELECT
+                    order_id,
+                    SUM(payment_value) AS order_value,
+                    COUNT(*) AS payment_rows
+                FROM payments
+                GROUP BY order_id
+            ) p ON o.order_id = p.order_id
+            GROUP BY o.customer_state
             ORDER BY avg_order_value DESC;
             """,
         ),
@@ -480,8 +834,7 @@ def main() -> None:
         ),
     ]
 
-    for name, sql in queries:
-        run_and_save(con, name, sql)
+    run_all(con, queries)
 
 
 if __name__ == "__main__":
@@ -1,26 +1,46 @@
+import io
 import os
+import re
+import time
+from collections import deque
+from functools import lru_cache, partial
 from pathlib import Path
 import logging
+from logging.handlers import RotatingFileHandler
 import warnings
 
 import duckdb
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
 import streamlit as st
 
-from run_target_queries import init_db
+import run_target_queries
+from run_target_queries import connect, parquet_path, publish_db
 
 # Configure logging
-# Configure logging
+# Keep only the most recent entries in the session's Activity Log
+MAX_LOG_ENTRIES = 500
+
+# Activity Log cell style per level; anything else is styled like INFO
+LEVEL_STYLES = {
+    'INFO': 'color: #10b981; font-weight: bold;',     # Green
+    'WARNING': 'color: #f59e0b; font-weight: bold;',  # Amber
+    'ERROR': 'color: #ef4444; font-weight: bold;',    # Red
+}
+
+# A bounded deque drops the oldest entry on append once it is full
 if 'log_data' not in st.session_state:
-    st.session_state['log_data'] = []
+    st.session_state['log_data'] = deque(maxlen=MAX_LOG_ENTRIES)
 
 class StreamlitLogHandler(logging.Handler):
     def emit(self, record):
-        log_entry = self.format(record)
-        st.session_state['log_data'].append(log_entry)
+        st.session_state['log_data'].append(self.format(record))
 
 # Setup logger
 logger = logging.getLogger(__name__)
@@ -28,8 +48,8 @@ logger.setLevel(logging.INFO)
 
 # Avoid adding multiple handlers on rerun
 if not logger.handlers:
-    # File handler
-    file_handler = logging.FileHandler('target_app.log')
+    # File handler, rotated so a long-running app doesn't grow it forever
+    file_handler = RotatingFileHandler('target_app.log', maxBytes=5_000_000, backupCount=3)
     file_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
     file_handler.setFormatter(file_formatter)
     logger.addHandler(file_handler)
@@ -39,13 +59,269 @@ if not logger.handlers:
     st_handler.setFormatter(file_formatter)
     logger.addHandler(st_handler)
 
+def log_tab_render(tab: str) -> None:
+    """Log a tab's first render in this session; reruns stay silent."""
+    rendered = st.session_state.setdefault('rendered_tabs', set())
+    if tab not in rendered:
+        rendered.add(tab)
+        logger.info(f"Rendering {tab} tab")
+
+def rank_colors(values, scale: str) -> list:
+    """
+    One colour per bar, sampled from a Plotly colorscale by the rank of its
+    value. Used instead of a continuous color axis, which adds a colorbar and
+    per-point interpolation to every figure.
+    """
+    ranks = np.argsort(np.argsort(np.asarray(values, dtype=float)))
+    palette = px.colors.sample_colorscale(scale, np.linspace(0, 1, len(ranks)))
+    return [palette[r] for r in ranks]
+
+# Shared dark chart styling; charts only set their own titles and overrides
+DARK_LAYOUT = dict(
+    plot_bgcolor='rgba(0,0,0,0)',
+    paper_bgcolor='rgba(0,0,0,0)',
+    font=dict(color='#cbd5e1'),
+    xaxis=dict(showgrid=False, gridcolor='rgba(255,255,255,0.1)'),
+    yaxis=dict(showgrid=True, gridcolor='rgba(255,255,255,0.1)'),
+)
+pio.templates["target_dark"] = go.layout.Template(layout=DARK_LAYOUT)
+pio.templates.default = "plotly+target_dark"
+
+# Attempts at opening the database read-only while another process has it
+# locked for writing, waiting 0.5s, 1s, 2s, ... between them
+DB_OPEN_ATTEMPTS = 5
+
 @st.cache_resource
 def get_connection() -> duckdb.DuckDBPyConnection:
-    return init_db()
+    """
+    Bring the database up to date once, then serve every session from a
+    read-only connection; the app never writes to it. publish_db builds
+    into a staging file and renames it into place, so other replicas
+    reading the file never see a write lock from this one.
+    """
+    db_path = run_target_queries.DB_PATH
+    try:
+        publish_db(db_path)
+    except (OSError, duckdb.IOException) as e:
+        # e.g. Windows refusing to replace a file other processes have open;
+        # the existing database is still usable, only not refreshed
+        if not db_path.exists():
+            raise
+        logger.warning(f"Using the existing database without refreshing it: {e}")
+
+    for attempt in range(DB_OPEN_ATTEMPTS):
+        try:
+            return connect(db_path, read_only=True)
+        except duckdb.IOException as e:
+            # Some other process has the file open for writing
+            if attempt == DB_OPEN_ATTEMPTS - 1:
+                raise
+            logger.warning(f"Database is locked, retrying: {e}")
+            time.sleep(0.5 * 2 ** attempt)
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def run_query(sql: str, as_pandas: bool = False, params: tuple = None):
+    """
+    Run a query and return the result as a pyarrow Table, which Plotly and
+    st.dataframe consume directly. Pass as_pandas=True only where pandas is
+    actually needed (Styler, column arithmetic); those frames keep Arrow-backed
+    dtypes instead of being boxed into NumPy/object columns.
+
+    Results are cached on the SQL text, so reruns skip DuckDB entirely. The
+    connection is fetched inside rather than passed in, since cache_data
+    cannot hash it. params binds the query's ? placeholders and is part of
+    the cache key.
+
+    Each call runs on its own cursor of the shared connection, so queries
+    from different sessions execute side by side instead of contending for
+    a single connection.
+    """
+    with get_connection().cursor() as cur:
+        table = shrink_table(cur.sql(sql, params=params).to_arrow_table())
+    return table.to_pandas(types_mapper=arrow_dtype) if as_pandas else table
+
+# Narrowest-first integer types shrink_table tries for BIGINT columns
+NARROW_INT_TYPES = (pa.int8(), pa.int16(), pa.int32())
+
+def shrink_table(table: pa.Table) -> pa.Table:
+    """
+    Narrow int64 columns to the smallest integer type that holds their range,
+    and dictionary-encode string columns with fewer distinct values than half
+    the rows. Results live in the cache for the whole session, so this keeps
+    it (and what is serialized to the browser) small. Floats and decimals are
+    left as they are, since narrowing them would change displayed amounts.
+    """
+    for i, field in enumerate(table.schema):
+        column = table.column(i)
+        if pa.types.is_int64(field.type):
+            bounds = pc.min_max(column)
+            lo, hi = bounds["min"].as_py(), bounds["max"].as_py()
+            if lo is None:
+                continue
+            for int_type in NARROW_INT_TYPES:
+                info = np.iinfo(int_type.to_pandas_dtype())
+                if info.min <= lo and hi <= info.max:
+                    table = table.set_column(i, field.name, column.cast(int_type))
+                    break
+        elif pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+            if pc.count_distinct(column).as_py() < table.num_rows / 2:
+                table = table.set_column(i, field.name, column.dictionary_encode())
+    return table
+
+def arrow_dtype(arrow_type: pa.DataType):
+    """
+    Map Arrow types to pd.ArrowDtype for to_pandas(). Dictionary columns
+    (DuckDB ENUMs) are left to become pandas Categoricals instead.
+    """
+    return None if pa.types.is_dictionary(arrow_type) else pd.ArrowDtype(arrow_type)
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def query_csv_bytes(sql: str) -> bytes:
+    """
+    Encode a query's (cached) result as CSV with pyarrow.csv. Handed to
+    st.download_button as a callable, so it only runs when the button is
+    clicked, and then once per query.
+    """
+    buffer = io.BytesIO()
+    pyarrow.csv.write_csv(run_query(sql), buffer)
+    return buffer.getvalue()
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def run_scalar_query(sql: str) -> tuple:
+    """Run a single-row query and return that row as a tuple."""
+    with get_connection().cursor() as cur:
+        return cur.execute(sql).fetchone()
+
+# Upper bound on points sent to the browser per time-series trace
+MAX_CHART_POINTS = 2000
+
+def lttb_indices(y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: pick n_out row positions that keep the
+    visual shape of the series y (x is taken as the row position). The first
+    and last points are always kept.
+    """
+    n = len(y)
+    x = np.arange(n, dtype=float)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    picked = [0]
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        ax, ay = x[picked[-1]], y[picked[-1]]
+        area = np.abs((ax - avg_x) * (y[start:end] - ay) - (ax - x[start:end]) * (avg_y - ay))
+        picked.append(start + int(area.argmax()))
+    picked.append(n - 1)
+    return np.asarray(picked)
+
+def downsample(data, y: str, max_points: int = MAX_CHART_POINTS):
+    """
+    Thin a time series (Arrow table or DataFrame, already sorted on x) to at
+    most max_points rows with LTTB before it is serialized for Plotly.
+    """
+    if len(data) <= max_points:
+        return data
+    idx = lttb_indices(np.asarray(data[y], dtype=float), max_points)
+    return data.take(idx) if isinstance(data, pa.Table) else data.iloc[idx]
+
+def get_state_aggregates() -> pd.DataFrame:
+    """
+    Total and average item price and freight per customer state, from one
+    pass over the orders x customers x order_items join. Shared by the
+    Economy and Delivery sections (the query result is cached).
+    """
+    return run_query(
+        """
+        SELECT
+            c.customer_state,
+            SUM(oi.price) AS total_order_price,
+            AVG(oi.price) AS avg_order_price,
+            SUM(oi.freight_value) AS total_freight_value,
+            AVG(oi.freight_value) AS avg_freight_value
+        FROM orders o
+        INNER JOIN customers c ON o.customer_id = c.customer_id
+        INNER JOIN order_items oi ON o.order_id = oi.order_id
+        GROUP BY c.customer_state;
+        """,
+        as_pandas=True,
+    )
+
+def get_order_rollups() -> tuple:
+    """
+    Yearly, monthly and time-of-day order counts from a single GROUPING SETS
+    scan of orders, split into (df_year, df_month, df_tod) Arrow tables.
+    """
+    rollup = run_query(
+        """
+        SELECT
+            GROUPING(order_year, order_month, time_of_day) AS grouping_id,
+            order_year,
+            order_month,
+            time_of_day,
+            printf('%d-%02d', order_year, order_month) AS year_month,
+            COUNT(*) AS cnt
+        FROM orders
+        GROUP BY GROUPING SETS ((order_year), (order_year, order_month), (time_of_day));
+        """
+    )
+
+    def grouping(gid: int):
+        return rollup.filter(pc.equal(rollup["grouping_id"], gid))
+
+    # GROUPING() sets a bit for every column that is rolled up in that set
+    df_year = (
+        grouping(0b011)
+        .select(["order_year", "cnt"])
+        .rename_columns(["order_year", "total_orders"])
+        .sort_by("order_year")
+    )
+    df_month = (
+        grouping(0b001)
+        .select(["order_year", "order_month", "year_month", "cnt"])
+        .rename_columns(["order_year", "order_month", "year_month", "total_orders"])
+        .sort_by([("order_year", "ascending"), ("order_month", "ascending")])
+    )
+    df_tod = (
+        grouping(0b110)
+        .select(["time_of_day", "cnt"])
+        .rename_columns(["time_of_day", "order_count"])
+        .sort_by([("order_count", "descending")])
+    )
+    return df_year, df_month, df_tod
+
+@st.cache_data
+def load_theme_css() -> str:
+    """Read assets/theme.css once, minified (comments and whitespace dropped)."""
+    css = (Path(__file__).parent / "assets" / "theme.css").read_text(encoding="utf-8")
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    return re.sub(r"\s*([{}:;,>])\s*", r"\1", css).strip()
 
-def run_query(sql: str) -> pd.DataFrame:
-    con = get_connection()
-    return con.execute(sql).fetch_df()
+@lru_cache(maxsize=128)
+def metric_html(icon: str, color: str, value: str, label: str, value_style: str = "") -> str:
+    """
+    One metric card. color is a #rrggbb hex; the card background is a
+    gradient of it at 15% and 5% opacity.
+    """
+    value_attr = f' style="{value_style}"' if value_style else ""
+    return (
+        f'<div class="metric-container" style="background: linear-gradient(135deg, {color}26, {color}0d);">'
+        f'<div class="metric-icon" style="color: {color};">{icon}</div>'
+        f'<div class="metric-value"{value_attr}>{value}</div>'
+        f'<div class="metric-label">{label}</div>'
+        "</div>"
+    )
+
+def metric_grid(cards: list, columns: int = 3) -> None:
+    """Render a row (or rows) of cards as one markdown element, `columns` per row."""
+    st.markdown(
+        f'<div class="metric-grid" style="grid-template-columns: repeat({columns}, 1fr);">'
+        + "".join(cards)
+        + "</div>",
+        unsafe_allow_html=True,
+    )
 
 def main() -> None:
     st.set_page_config(
@@ -56,235 +332,7 @@ def main() -> None:
     )
 
     # Enhanced Custom CSS matching Walmart style
-    st.markdown("""
-    <style>
-        @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;600;700;800&display=swap');
-        
-        * {
-            font-family: 'Inter', sans-serif;
-        }
-        
-        .main {
-            background: linear-gradient(135deg, #0f0c29 0%, #302b63 50%, #24243e 100%);
-            background-attachment: fixed;
-        }
-        .block-container {
-            background: rgba(17, 24, 39, 0.85);
-            border-radius: 20px;
-            padding: 2rem;
-            box-shadow: 0 20px 60px rgba(0,0,0,0.7);
-            backdrop-filter: blur(20px);
-            border: 1px solid rgba(139, 92, 246, 0.2);
-        }
-        h1 {
-            background: linear-gradient(135deg, #a78bfa 0%, #f472b6 50%, #fb923c 100%);
-            -webkit-background-clip: text;
-            -webkit-text-fill-color: transparent;
-            font-size: 3.5rem !important;
-            font-weight: 800 !important;
-            text-align: center;
-            margin-bottom: 1rem;
-            animation: fadeInDown 1s ease-in-out;
-            letter-spacing: -1px;
-        }
-        h2 { 
-            color: #f3f4f6 !important; 
-            border-bottom: 3px solid #8b5cf6; 
-            padding-bottom: 0.5rem; 
-            margin-top: 2rem; 
-            font-weight: 700 !important;
-            text-shadow: 0 2px 10px rgba(139, 92, 246, 0.3);
-        }
-        h3 { 
-            color: #e5e7eb !important; 
-            margin-top: 1.5rem; 
-            font-weight: 600 !important; 
-        }
-        p, li, span, div { color: #cbd5e1; }
-        
-        [data-testid="stMetricValue"] {
-            background: linear-gradient(135deg, #a78bfa 0%, #f472b6 100%);
-            -webkit-background-clip: text;
-            -webkit-text-fill-color: transparent;
-            font-size: 2.8rem !important;
-            font-weight: 800 !important;
-            text-align: center;
-            margin-bottom: 0.5rem;
-            animation: pulse 2s ease-in-out infinite;
-        }
-        [data-testid="stMetricLabel"] { 
-            color: #9ca3af !important; 
-            font-weight: 600;
-            text-transform: uppercase;
-            letter-spacing: 1px;
-            font-size: 0.75rem !important;
-        }
-        
-        .stTabs [data-baseweb="tab-list"] { 
-            gap: 12px; 
-            background-color: rgba(17, 24, 39, 0.5);
-            padding: 0.5rem;
-            border-radius: 12px;
-        }
-        .stTabs [data-baseweb="tab"] {
-            background: linear-gradient(135deg, rgba(139, 92, 246, 0.1) 0%, rgba(244, 114, 182, 0.1) 100%);
-            color: #a78bfa; 
-            border-radius: 10px; 
-            padding: 12px 24px; 
-            font-weight: 600; 
-            transition: all 0.3s ease; 
-            border: 1px solid rgba(139, 92, 246, 0.3);
-        }
-        .stTabs [data-baseweb="tab"]:hover { 
-            background: linear-gradient(135deg, rgba(139, 92, 246, 0.2) 0%, rgba(244, 114, 182, 0.2) 100%);
-            transform: translateY(-2px); 
-            box-shadow: 0 4px 12px rgba(139, 92, 246, 0.4);
-        }
-        .stTabs [aria-selected="true"] {
-            background: linear-gradient(135deg, #8b5cf6 0%, #ec4899 100%) !important; 
-            color: white !important; 
-            box-shadow: 0 6px 20px rgba(139, 92, 246, 0.6);
-            transform: translateY(-2px);
-        }
-        
-        [data-testid="stSidebar"] { 
-            background: linear-gradient(180deg, #1e1b4b 0%, #312e81 100%); 
-            border-right: 1px solid rgba(139, 92, 246, 0.3);
-        }
-        [data-testid="stSidebar"] h1, 
-        [data-testid="stSidebar"] h2, 
-        [data-testid="stSidebar"] h3 { 
-            color: white !important; 
-            -webkit-text-fill-color: white !important; 
-        }
-        [data-testid="stSidebar"] p, 
-        [data-testid="stSidebar"] li, 
-        [data-testid="stSidebar"] span { 
-            color: #cbd5e1 !important; 
-        }
-        
-        .stButton > button {
-            background: linear-gradient(135deg, #8b5cf6 0%, #ec4899 100%); 
-            color: white; 
-            border-radius: 12px; 
-            padding: 0.75rem 2rem; 
-            font-weight: 600; 
-            box-shadow: 0 4px 15px rgba(139, 92, 246, 0.4); 
-            border: none;
-            transition: all 0.3s ease;
-        }
-        .stButton > button:hover { 
-            transform: translateY(-3px); 
-            box-shadow: 0 8px 25px rgba(139, 92, 246, 0.6); 
-            color: white; 
-        }
-        
-        @keyframes fadeInDown { 
-            from { opacity: 0; transform: translateY(-30px); } 
-            to { opacity: 1; transform: translateY(0); } 
-        }
-        
-        @keyframes pulse {
-            0%, 100% { opacity: 1; }
-            50% { opacity: 0.8; }
-        }
-        
-        .card {
-            padding: 1rem; 
-            border-radius: 16px; 
-            text-align: center; 
-            color: white; 
-            box-shadow: 0 8px 32px rgba(0,0,0,0.4); 
-            transition: all 0.4s ease; 
-            border: 1px solid rgba(255,255,255,0.1);
-            position: relative;
-            overflow: hidden;
-        }
-        .card::before {
-            content: '';
-            position: absolute;
-            top: 0;
-            left: -100%;
-            width: 100%;
-            height: 100%;
-            background: linear-gradient(90deg, transparent, rgba(255,255,255,0.1), transparent);
-            transition: left 0.5s;
-        }
-        .card:hover::before {
-            left: 100%;
-        }
-        .card:hover { 
-            transform: translateY(-8px) scale(1.02); 
-            box-shadow: 0 12px 40px rgba(139, 92, 246, 0.4);
-        }
-        
-        .metric-card {
-            background: linear-gradient(135deg, rgba(139, 92, 246, 0.1) 0%, rgba(244, 114, 182, 0.1) 100%);
-            border: 1px solid rgba(139, 92, 246, 0.3);
-            border-radius: 12px;
-            padding: 1.5rem;
-            transition: all 0.3s ease;
-        }
-        .metric-card:hover {
-            background: linear-gradient(135deg, rgba(139, 92, 246, 0.2) 0%, rgba(244, 114, 182, 0.2) 100%);
-            border-color: rgba(139, 92, 246, 0.5);
-            transform: translateY(-4px);
-            box-shadow: 0 8px 20px rgba(139, 92, 246, 0.3);
-        }
-        
-        .stExpander {
-            background: rgba(17, 24, 39, 0.5);
-            border: 1px solid rgba(139, 92, 246, 0.2);
-            border-radius: 12px;
-        }
-        
-        .stDataFrame {
-            border-radius: 12px;
-            overflow: hidden;
-        }
-        
-        .metric-container {
-            background: rgba(17, 24, 39, 0.7);
-            padding: 1.5rem;
-            border-radius: 16px;
-            border: 1px solid rgba(139, 92, 246, 0.2);
-            transition: all 0.3s ease;
-            text-align: center;
-            position: relative;
-            overflow: hidden;
-        }
-        .metric-container:hover {
-            transform: translateY(-5px);
-            box-shadow: 0 10px 30px rgba(139, 92, 246, 0.3);
-            border-color: rgba(139, 92, 246, 0.5);
-        }
-        .metric-value {
-            font-size: 2.5rem;
-            font-weight: 800;
-            background: linear-gradient(135deg, #fff 0%, #cbd5e1 100%);
-            -webkit-background-clip: text;
-            -webkit-text-fill-color: transparent;
-            margin: 0.5rem 0;
-        }
-        .metric-label {
-            color: #94a3b8;
-            font-size: 0.9rem;
-            text-transform: uppercase;
-            letter-spacing: 1.5px;
-            font-weight: 600;
-        }
-        .metric-icon {
-            font-size: 1.5rem;
-            margin-bottom: 0.5rem;
-            background: rgba(139, 92, 246, 0.1);
-            width: 50px;
-            height: 50px;
-            line-height: 50px;
-            border-radius: 50%;
-            margin: 0 auto 1rem auto;
-        }
-    </style>
-    """, unsafe_allow_html=True)
+    st.markdown(f"<style>{load_theme_css()}</style>", unsafe_allow_html=True)
 
     # Header with animation
     st.markdown("""
@@ -344,9 +392,6 @@ def main() -> None:
     st.markdown("<br>", unsafe_allow_html=True)
 
     # Sidebar
-    BASE_DIR = Path(r"C:\Users\rattu\Downloads\Target SQL")
-    DATA_DIR = BASE_DIR / "Target- SQL Business Case ALL 8 CSV"
-
     with st.sidebar:
         st.markdown("## 📑 Navigation")
         st.markdown("---")
@@ -354,7 +399,7 @@ def main() -> None:
         <div style='background: rgba(139, 92, 246, 0.1); padding: 1rem; border-radius: 10px; border: 1px solid rgba(139, 92, 246, 0.3);'>
             <h3 style='color: #a78bfa !important; margin-top: 0;'>⚙️ Configuration</h3>
             <p><strong>Data Source:</strong> DuckDB</p>
-            <p style='font-size: 0.8rem; word-break: break-all;'>{DATA_DIR}</p>
+            <p style='font-size: 0.8rem; word-break: break-all;'>{run_target_queries.DATA_DIR}</p>
         </div>
         """, unsafe_allow_html=True)
         
@@ -372,1004 +417,799 @@ def main() -> None:
         </div>
         """, unsafe_allow_html=True)
 
-    tab_overview, tab_orders, tab_geo, tab_econ, tab_delivery, tab_pay, tab_prod, tab_raw, tab_log = st.tabs(
-        [
-            "Overview",
-            "Orders & Trends",
-            "Geography",
-            "Economy",
-            "Delivery & Freight",
-            "Payments",
-            "Products & Reviews",
-            "Raw Tables",
-            "Activity Log",
-        ]
+        st.markdown("<br>", unsafe_allow_html=True)
+
+        if st.button("🔄 Clear cache", width='stretch'):
+            st.cache_data.clear()
+            logger.info("Query cache cleared")
+
+    # st.tabs runs every tab's body on each rerun, so a radio picks the one
+    # section to render and only its queries execute
+    active_tab = st.radio(
+        "Section",
+        list(SECTIONS),
+        horizontal=True,
+        label_visibility="collapsed",
+        key="active_tab",
     )
 
-    # --- Overview ---
-    with tab_overview:
-        st.header("📊 Executive Summary")
-        logger.info("Rendering Overview tab")
-        
-        # Time range
-        # Time range
-        df_time = run_query(
-            """
+    # Open the database before any section queries it, so a failure is
+    # reported once here instead of in every chart
+    try:
+        get_connection()
+    except (OSError, duckdb.Error) as e:
+        logger.error(f"Database unavailable: {e}")
+        st.error(
+            f"Could not open the database: {e}\n\n"
+            "If another process is writing to it, wait for it to finish and reload the page."
+        )
+        st.stop()
+
+    # Each section is a fragment, so a widget inside one reruns only that
+    # section rather than the whole script
+    SECTIONS[active_tab]()
+
+@st.fragment
+def render_overview() -> None:
+    """Executive summary: headline counts, yearly trend, time of day."""
+    st.header("📊 Executive Summary")
+    log_tab_render("Overview")
+    
+    # Time range and key counts in one round-trip; the orders aggregates
+    # share a single scan. Customer and seller counts are approximate.
+    (
+        first_date, last_date, total_days,
+        total_orders, total_customers, total_sellers,
+    ) = run_scalar_query(
+        """
+        WITH o AS (
             SELECT
                 MIN(order_purchase_timestamp) AS first_order_date,
                 MAX(order_purchase_timestamp) AS last_order_date,
-                date_diff('day',
-                          MIN(order_purchase_timestamp),
-                          MAX(order_purchase_timestamp)) AS total_days
-            FROM orders;
-            """
+                COUNT(*) AS total_orders
+            FROM orders
         )
+        SELECT
+            o.first_order_date,
+            o.last_order_date,
+            date_diff('day', o.first_order_date, o.last_order_date) AS total_days,
+            o.total_orders,
+            -- Headline figures only, so HyperLogLog estimates are enough
+            (SELECT approx_count_distinct(customer_id) FROM customers) AS total_customers,
+            (SELECT approx_count_distinct(seller_id) FROM sellers) AS total_sellers
+        FROM o;
+        """
+    )
+
+    # The aggregates come back as None when the table is empty
+    first_date_str = "N/A" if first_date is None else str(first_date.date())
+    last_date_str = "N/A" if last_date is None else str(last_date.date())
+    total_days = 0 if total_days is None else int(total_days)
+
+    # All six cards go out as one markdown element, in two rows of three
+    metric_grid([
+        metric_html("📦", "#667eea", f"{total_orders:,}", "Total Orders"),
+        metric_html("👥", "#f472b6", f"~ {total_customers:,}", "Unique Customers"),
+        metric_html("🏪", "#38ef7d", f"~ {total_sellers:,}", "Unique Sellers"),
+        metric_html("📅", "#fb923c", first_date_str, "First Order", "font-size: 1.8rem;"),
+        metric_html("🏁", "#8b5cf6", last_date_str, "Last Order", "font-size: 1.8rem;"),
+        metric_html("⏳", "#ec4899", f"{total_days}", "Total Days"),
+    ])
+
+    st.subheader("Yearly Order Trend")
+    df_year, _, df_tod = get_order_rollups()
+    # Plotly Line Chart
+    fig = px.line(downsample(df_year, 'total_orders'), x='order_year', y='total_orders', markers=True, 
+                  title='Total Orders per Year')
+    fig.update_layout(
+        xaxis_title='Year',
+        yaxis_title='Total Orders',
+        hovermode='x unified'
+    )
+    fig.update_traces(line_color='#8b5cf6', line_width=4, marker_size=10)
+    st.plotly_chart(fig, width='stretch')
+
+    st.subheader("Time of Day Distribution")
+    # Four static bars, so the native Vega-Lite chart is enough
+    st.bar_chart(
+        df_tod, x='time_of_day', y='order_count',
+        x_label='Time of Day', y_label='Order Count',
+        color='#8b5cf6', sort='-order_count',
+    )
+
+@st.fragment
+def render_orders() -> None:
+    """Monthly order volume and year-over-year growth."""
+    st.header("📈 Orders & Trends Analysis")
+    log_tab_render("Orders & Trends")
+    
+    col1, col2 = st.columns([2, 1])
+    
+    with col1:
+        st.subheader("Orders Over Time")
+        df_month = get_order_rollups()[1]
         
-        if not df_time.empty:
-            first_date = df_time.at[0, "first_order_date"]
-            last_date = df_time.at[0, "last_order_date"]
-            total_days = df_time.at[0, "total_days"]
-            
-            # Handle potential None values if table is empty but query returns a row of Nulls
-            if pd.isna(first_date):
-                first_date_str = "N/A"
-            else:
-                first_date_str = str(first_date.date())
-                
-            if pd.isna(last_date):
-                last_date_str = "N/A"
-            else:
-                last_date_str = str(last_date.date())
-                
-            if pd.isna(total_days):
-                total_days = 0
-            else:
-                total_days = int(total_days)
+        if df_month.num_rows:
+            # Plotly Area Chart
+            fig = px.area(downsample(df_month, 'total_orders'), x='year_month', y='total_orders',
+                          title='Monthly Order Volume',
+                          labels={'year_month': 'Month', 'total_orders': 'Orders'})
+            fig.update_layout(
+                hovermode='x unified'
+            )
+            fig.update_traces(line_color='#f472b6', fillcolor='rgba(244, 114, 182, 0.2)')
+            st.plotly_chart(fig, width='stretch')
         else:
-            first_date_str = "N/A"
-            last_date_str = "N/A"
-            total_days = 0
+            st.info("No order data available for the selected period.")
 
-        # Total orders and customers
-        df_counts = run_query(
-            """
+    with col2:
+        st.subheader("Monthly Data")
+        if df_month.num_rows:
+            st.dataframe(df_month.select(['year_month', 'total_orders']), width='stretch', height=400)
+        else:
+            st.write("No data.")
+
+    st.markdown("---")
+    
+    st.subheader("📊 Year-over-Year Growth")
+    df_yoy = run_query(
+        """
+        WITH yearly AS (
             SELECT
-                (SELECT COUNT(*) FROM orders) AS total_orders,
-                (SELECT COUNT(DISTINCT customer_id) FROM customers) AS total_customers,
-                (SELECT COUNT(DISTINCT seller_id) FROM sellers) AS total_sellers
-            ;
-            """
-        )
-        total_orders = int(df_counts.at[0, "total_orders"])
-        total_customers = int(df_counts.at[0, "total_customers"])
-        total_sellers = int(df_counts.at[0, "total_sellers"])
-
-        # Row 1: Key Counts
-        m1, m2, m3 = st.columns(3)
-        with m1:
-            st.markdown(f"""
-            <div class="metric-container" style='background: linear-gradient(135deg, rgba(102, 126, 234, 0.15), rgba(102, 126, 234, 0.05));'>
-                <div class="metric-icon" style="color: #667eea;">📦</div>
-                <div class="metric-value">{total_orders:,}</div>
-                <div class="metric-label">Total Orders</div>
-            </div>
-            """, unsafe_allow_html=True)
-        with m2:
-            st.markdown(f"""
-            <div class="metric-container" style='background: linear-gradient(135deg, rgba(244, 114, 182, 0.15), rgba(244, 114, 182, 0.05));'>
-                <div class="metric-icon" style="color: #f472b6;">👥</div>
-                <div class="metric-value">{total_customers:,}</div>
-                <div class="metric-label">Unique Customers</div>
-            </div>
-            """, unsafe_allow_html=True)
-        with m3:
-            st.markdown(f"""
-            <div class="metric-container" style='background: linear-gradient(135deg, rgba(56, 239, 125, 0.15), rgba(56, 239, 125, 0.05));'>
-                <div class="metric-icon" style="color: #38ef7d;">🏪</div>
-                <div class="metric-value">{total_sellers:,}</div>
-                <div class="metric-label">Unique Sellers</div>
-            </div>
-            """, unsafe_allow_html=True)
-            
-        st.markdown("<br>", unsafe_allow_html=True)
-        
-        # Row 2: Time Metrics
-        m4, m5, m6 = st.columns(3)
-        with m4:
-            st.markdown(f"""
-            <div class="metric-container" style='background: linear-gradient(135deg, rgba(251, 146, 60, 0.15), rgba(251, 146, 60, 0.05));'>
-                <div class="metric-icon" style="color: #fb923c;">📅</div>
-                <div class="metric-value" style="font-size: 1.8rem;">{first_date_str}</div>
-                <div class="metric-label">First Order</div>
-            </div>
-            """, unsafe_allow_html=True)
-        with m5:
-            st.markdown(f"""
-            <div class="metric-container" style='background: linear-gradient(135deg, rgba(139, 92, 246, 0.15), rgba(139, 92, 246, 0.05));'>
-                <div class="metric-icon" style="color: #8b5cf6;">🏁</div>
-                <div class="metric-value" style="font-size: 1.8rem;">{last_date_str}</div>
-                <div class="metric-label">Last Order</div>
-            </div>
-            """, unsafe_allow_html=True)
-        with m6:
-            st.markdown(f"""
-            <div class="metric-container" style='background: linear-gradient(135deg, rgba(236, 72, 153, 0.15), rgba(236, 72, 153, 0.05));'>
-                <div class="metric-icon" style="color: #ec4899;">⏳</div>
-                <div class="metric-value">{total_days}</div>
-                <div class="metric-label">Total Days</div>
-            </div>
-            """, unsafe_allow_html=True)
-
-        st.subheader("Yearly Order Trend")
-        df_year = run_query(
-            """
-            WITH yearly AS (
-                SELECT
-                    EXTRACT(year FROM order_purchase_timestamp) AS order_year,
-                    COUNT(*) AS total_orders
-                FROM orders
-                GROUP BY order_year
-            )
-            SELECT * FROM yearly ORDER BY order_year;
-            """
+                order_year,
+                COUNT(*) AS total_orders
+            FROM orders
+            GROUP BY order_year
+        ),
+        with_lag AS (
+            SELECT
+                order_year,
+                total_orders,
+                LAG(total_orders) OVER (ORDER BY order_year) AS previous_year_orders
+            FROM yearly
         )
-        # Plotly Line Chart
-        fig = px.line(df_year, x='order_year', y='total_orders', markers=True, 
-                      title='Total Orders per Year')
-        fig.update_layout(
-            plot_bgcolor='rgba(0,0,0,0)',
-            paper_bgcolor='rgba(0,0,0,0)',
-            font=dict(color='#cbd5e1'),
-            xaxis=dict(showgrid=False, title='Year'),
-            yaxis=dict(showgrid=True, gridcolor='rgba(255,255,255,0.1)', title='Total Orders'),
-            hovermode='x unified'
+        SELECT
+            order_year,
+            total_orders,
+            previous_year_orders,
+            (total_orders - previous_year_orders) * 100.0
+                / NULLIF(previous_year_orders, 0) AS year_over_year_growth_pct
+        FROM with_lag
+        ORDER BY order_year;
+        """
+    )
+    
+    if df_yoy.num_rows:
+        # Formatted client-side by the grid instead of a server-rendered Styler
+        st.dataframe(
+            df_yoy,
+            column_config={
+                'year_over_year_growth_pct': st.column_config.NumberColumn(format='%.2f%%'),
+                'total_orders': st.column_config.NumberColumn(format='localized'),
+                'previous_year_orders': st.column_config.NumberColumn(format='localized'),
+            },
+            width='stretch'
         )
-        fig.update_traces(line_color='#8b5cf6', line_width=4, marker_size=10)
-        st.plotly_chart(fig, width='stretch')
+    else:
+        st.info("No year-over-year data available.")
 
-        st.subheader("Time of Day Distribution")
-        df_tod = run_query(
+@st.fragment
+def render_geography() -> None:
+    """Customers per state and month-on-month orders by state."""
+    st.header("🗺️ Geographic Distribution")
+    log_tab_render("Geography")
+    
+    col1, col2 = st.columns([1.5, 1])
+    
+    with col1:
+        st.subheader("Customer Distribution by State")
+        df_state = run_query(
             """
-            WITH classified AS (
+            WITH counts AS (
                 SELECT
-                    CASE
-                        WHEN EXTRACT(hour FROM order_purchase_timestamp) BETWEEN 0 AND 6  THEN 'Dawn'
-                        WHEN EXTRACT(hour FROM order_purchase_timestamp) BETWEEN 7 AND 12 THEN 'Morning'
-                        WHEN EXTRACT(hour FROM order_purchase_timestamp) BETWEEN 13 AND 18 THEN 'Afternoon'
-                        WHEN EXTRACT(hour FROM order_purchase_timestamp) BETWEEN 19 AND 23 THEN 'Night'
-                    END AS time_of_day
-                FROM orders
+                    customer_state,
+                    COUNT(DISTINCT customer_id) AS total_customers
+                FROM customers
+                GROUP BY customer_state
             )
             SELECT
-                time_of_day,
-                COUNT(*) AS order_count
-            FROM classified
-            GROUP BY time_of_day
-            ORDER BY order_count DESC;
-            """
+                customer_state,
+                total_customers,
+                ROUND(total_customers * 100.0 / SUM(total_customers) OVER (), 2) AS percentage
+            FROM counts
+            ORDER BY total_customers DESC;
+            """,
+            as_pandas=True,
         )
-        # Plotly Bar Chart
-        fig = px.bar(df_tod, x='time_of_day', y='order_count', 
-                     color='order_count', color_continuous_scale='RdBu_r',
-                     title='Orders by Time of Day')
-        fig.update_layout(
-            plot_bgcolor='rgba(0,0,0,0)',
-            paper_bgcolor='rgba(0,0,0,0)',
-            font=dict(color='#cbd5e1'),
-            xaxis=dict(showgrid=False, title='Time of Day'),
-            yaxis=dict(showgrid=True, gridcolor='rgba(255,255,255,0.1)', title='Order Count')
-        )
-        st.plotly_chart(fig, width='stretch')
-
-    # --- Orders & Trends ---
-    with tab_orders:
-        st.header("📈 Orders & Trends Analysis")
-        logger.info("Rendering Orders & Trends tab")
-        
-        col1, col2 = st.columns([2, 1])
         
-        with col1:
-            st.subheader("Orders Over Time")
-            df_month = run_query(
-                """
-                SELECT
-                    EXTRACT(year  FROM order_purchase_timestamp) AS order_year,
-                    EXTRACT(month FROM order_purchase_timestamp) AS order_month,
-                    COUNT(*) AS total_orders
-                FROM orders
-                GROUP BY order_year, order_month
-                ORDER BY order_year, order_month;
-                """
+        if not df_state.empty:
+            # Plotly Bar Chart (Horizontal for better readability of states)
+            fig = px.bar(df_state, x='total_customers', y='customer_state', orientation='h',
+                         title='Customers per State')
+            fig.update_traces(marker_color=rank_colors(df_state['total_customers'], 'Viridis'))
+            fig.update_layout(
+                xaxis=dict(showgrid=True, title='Total Customers'),
+                yaxis=dict(showgrid=False, title='State', categoryorder='total ascending'),
+                height=600
             )
-            
-            if not df_month.empty:
-                df_month["year_month"] = (
-                    df_month["order_year"].astype(int).astype(str)
-                    + "-"
-                    + df_month["order_month"].astype(int).astype(str).str.zfill(2)
-                )
-                
-                # Plotly Area Chart
-                fig = px.area(df_month, x='year_month', y='total_orders',
-                              title='Monthly Order Volume',
-                              labels={'year_month': 'Month', 'total_orders': 'Orders'})
-                fig.update_layout(
-                    plot_bgcolor='rgba(0,0,0,0)',
-                    paper_bgcolor='rgba(0,0,0,0)',
-                    font=dict(color='#cbd5e1'),
-                    xaxis=dict(showgrid=False),
-                    yaxis=dict(showgrid=True, gridcolor='rgba(255,255,255,0.1)'),
-                    hovermode='x unified'
-                )
-                fig.update_traces(line_color='#f472b6', fillcolor='rgba(244, 114, 182, 0.2)')
-                st.plotly_chart(fig, width='stretch')
-            else:
-                st.info("No order data available for the selected period.")
-
-        with col2:
-            st.subheader("Monthly Data")
-            if not df_month.empty:
-                st.dataframe(df_month[['year_month', 'total_orders']], width='stretch', height=400)
-            else:
-                st.write("No data.")
+            st.plotly_chart(fig, width='stretch')
+        else:
+            st.info("No customer location data available.")
 
-        st.markdown("---")
-        
-        st.subheader("📊 Year-over-Year Growth")
-        df_yoy = run_query(
-            """
-            WITH yearly AS (
-                SELECT
-                    EXTRACT(year FROM order_purchase_timestamp) AS order_year,
-                    COUNT(*) AS total_orders
-                FROM orders
-                GROUP BY order_year
+    with col2:
+        st.subheader("State Statistics")
+        if not df_state.empty:
+            st.dataframe(
+                df_state,
+                column_config={
+                    'total_customers': st.column_config.ProgressColumn(
+                        format='localized',
+                        min_value=0,
+                        max_value=int(df_state['total_customers'].max()),
+                    ),
+                    'percentage': st.column_config.NumberColumn(format='%.2f%%'),
+                },
+                width='stretch',
+                height=600
             )
+        else:
+            st.write("No data.")
+
+    st.markdown("---")
+    
+    st.subheader("Month-on-Month Orders by State")
+    # Filter in SQL so only the chosen states are shipped to the browser
+    states = df_state['customer_state'].astype(str).tolist()
+    selected_states = st.multiselect("States", states, default=states[:5])
+    df_mom_state = run_query(
+        """
+        SELECT
+            c.customer_state,
+            o.order_year,
+            o.order_month,
+            COUNT(*) AS total_orders
+        FROM orders o
+        INNER JOIN customers c ON o.customer_id = c.customer_id
+        WHERE list_contains(?, c.customer_state)
+        GROUP BY c.customer_state, order_year, order_month
+        ORDER BY c.customer_state, order_year, order_month;
+        """,
+        params=(selected_states,),
+    )
+    if df_mom_state.num_rows:
+        st.dataframe(df_mom_state, width='stretch')
+    else:
+        st.info("No month-on-month order data by state available.")
+
+@st.fragment
+def render_economy() -> None:
+    """Cost increase, order prices and freight by state."""
+    st.header("💰 Economic Analysis")
+    log_tab_render("Economy")
+    
+    st.subheader("Cost Increase: 2017 → 2018 (Jan–Aug)")
+    cost_row = run_scalar_query(
+        """
+        WITH OrderCosts AS (
             SELECT
-                order_year,
-                total_orders,
-                LAG(total_orders) OVER (ORDER BY order_year) AS previous_year_orders,
-                CASE
-                    WHEN LAG(total_orders) OVER (ORDER BY order_year) IS NULL THEN NULL
-                    ELSE (total_orders - LAG(total_orders) OVER (ORDER BY order_year))
-                         * 100.0 / LAG(total_orders) OVER (ORDER BY order_year)
-                END AS year_over_year_growth_pct
-            FROM yearly
-            ORDER BY order_year;
-            """
+                SUM(p.payment_value) FILTER (WHERE o.order_year = 2018) AS cost_2018,
+                SUM(p.payment_value) FILTER (WHERE o.order_year = 2017) AS cost_2017
+            FROM orders o
+            INNER JOIN payments p ON o.order_id = p.order_id
+            WHERE o.order_year IN (2017, 2018)
+              AND o.order_month BETWEEN 1 AND 8
         )
-        
-        if not df_yoy.empty:
-            # Formatted dataframe with styling
+        SELECT
+            cost_2018,
+            cost_2017,
+            ROUND((cost_2018 - cost_2017) * 100.0 / NULLIF(cost_2017, 0), 2) AS percentage_increase
+        FROM OrderCosts;
+        """
+    )
+    
+    if cost_row is not None:
+        cost_2018, cost_2017, pct_increase = (0 if v is None else v for v in cost_row)
+
+        # Custom Metric Cards for Cost Analysis
+        metric_grid([
+            metric_html("📉", "#667eea", f"${cost_2017:,.2f}", "Total Cost 2017 (Jan-Aug)"),
+            metric_html("📈", "#f472b6", f"${cost_2018:,.2f}", "Total Cost 2018 (Jan-Aug)"),
+            metric_html("🚀", "#38ef7d", f"{pct_increase:.2f}%", "Increase Percentage"),
+        ])
+    else:
+        st.info("No cost data available for 2017-2018 comparison.")
+
+    st.markdown("---")
+    
+    df_state_totals = get_state_aggregates()
+
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.subheader("Order Price by State")
+        df_price_state = (
+            df_state_totals[['customer_state', 'total_order_price', 'avg_order_price']]
+            .sort_values('total_order_price', ascending=False, ignore_index=True)
+        )
+        if not df_price_state.empty:
             st.dataframe(
-                df_yoy.style.format({
-                    'year_over_year_growth_pct': '{:.2f}%',
-                    'total_orders': '{:,}',
-                    'previous_year_orders': '{:,.0f}'
-                }).background_gradient(subset=['year_over_year_growth_pct'], cmap='RdYlGn'),
-                width='stretch'
+                df_price_state,
+                column_config={
+                    'total_order_price': st.column_config.ProgressColumn(
+                        format='dollar',
+                        min_value=0,
+                        max_value=float(df_price_state['total_order_price'].max()),
+                    ),
+                    'avg_order_price': st.column_config.NumberColumn(format='dollar'),
+                },
+                width='stretch',
+                height=400
             )
         else:
-            st.info("No year-over-year data available.")
-
-    # --- Geography ---
-    with tab_geo:
-        st.header("🗺️ Geographic Distribution")
-        logger.info("Rendering Geography tab")
-        
-        col1, col2 = st.columns([1.5, 1])
+            st.write("No data.")
         
-        with col1:
-            st.subheader("Customer Distribution by State")
-            df_state = run_query(
-                """
-                WITH counts AS (
-                    SELECT
-                        customer_state,
-                        COUNT(DISTINCT customer_id) AS total_customers
-                    FROM customers
-                    GROUP BY customer_state
-                )
-                SELECT
-                    customer_state,
-                    total_customers,
-                    ROUND(total_customers * 100.0 / SUM(total_customers) OVER (), 2) AS percentage
-                FROM counts
-                ORDER BY total_customers DESC;
-                """
+    with col2:
+        st.subheader("Freight Value by State")
+        df_freight_state = (
+            df_state_totals[['customer_state', 'total_freight_value', 'avg_freight_value']]
+            .sort_values('total_freight_value', ascending=False, ignore_index=True)
+        )
+        if not df_freight_state.empty:
+            st.dataframe(
+                df_freight_state,
+                column_config={
+                    'total_freight_value': st.column_config.ProgressColumn(
+                        format='dollar',
+                        min_value=0,
+                        max_value=float(df_freight_state['total_freight_value'].max()),
+                    ),
+                    'avg_freight_value': st.column_config.NumberColumn(format='dollar'),
+                },
+                width='stretch',
+                height=400
             )
-            
-            if not df_state.empty:
-                # Plotly Bar Chart (Horizontal for better readability of states)
-                fig = px.bar(df_state, x='total_customers', y='customer_state', orientation='h',
-                             title='Customers per State',
-                             color='total_customers', color_continuous_scale='viridis')
-                fig.update_layout(
-                    plot_bgcolor='rgba(0,0,0,0)',
-                    paper_bgcolor='rgba(0,0,0,0)',
-                    font=dict(color='#cbd5e1'),
-                    xaxis=dict(showgrid=True, gridcolor='rgba(255,255,255,0.1)', title='Total Customers'),
-                    yaxis=dict(showgrid=False, title='State', categoryorder='total ascending'),
-                    height=600
-                )
-                st.plotly_chart(fig, width='stretch')
-            else:
-                st.info("No customer location data available.")
+        else:
+            st.write("No data.")
 
-        with col2:
-            st.subheader("State Statistics")
-            if not df_state.empty:
-                st.dataframe(
-                    df_state.style.format({
-                        'percentage': '{:.2f}%',
-                        'total_customers': '{:,}'
-                    }).background_gradient(subset=['total_customers'], cmap='viridis'),
-                    width='stretch',
-                    height=600
-                )
-            else:
-                st.write("No data.")
+@st.fragment
+def render_delivery() -> None:
+    """Delivery times, freight and fastest/slowest states."""
+    st.header("🚚 Delivery & Freight Analysis")
+    log_tab_render("Delivery & Freight")
+    
+    st.subheader("Delivery Time vs Estimated")
+    # Binned per whole day in DuckDB, so only one row per bin reaches Plotly
+    df_delivery = run_query(
+        """
+        SELECT
+            date_diff('day', order_purchase_timestamp, order_delivered_customer_date) AS time_to_deliver,
+            COUNT(*) AS order_count
+        FROM orders
+        WHERE order_delivered_customer_date IS NOT NULL
+          AND order_estimated_delivery_date IS NOT NULL
+        GROUP BY time_to_deliver
+        ORDER BY time_to_deliver;
+        """
+    )
+    
+    if df_delivery.num_rows:
+        # Plotly Bar Chart over the precomputed histogram bins
+        fig = px.bar(df_delivery, x='time_to_deliver', y='order_count',
+                     title='Distribution of Delivery Times (Days)',
+                     color_discrete_sequence=['#8b5cf6'])
+        fig.update_layout(
+            xaxis_title='Days to Deliver',
+            yaxis_title='Count',
+            bargap=0.1
+        )
+        st.plotly_chart(fig, width='stretch')
+    else:
+        st.info("No delivery time data available.")
 
-        st.markdown("---")
-        
-        st.subheader("Month-on-Month Orders by State")
-        df_mom_state = run_query(
-            """
-            SELECT
-                c.customer_state,
-                EXTRACT(year  FROM o.order_purchase_timestamp) AS order_year,
-                EXTRACT(month FROM o.order_purchase_timestamp) AS order_month,
-                COUNT(*) AS total_orders
-            FROM orders o
-            INNER JOIN customers c ON o.customer_id = c.customer_id
-            GROUP BY c.customer_state, order_year, order_month
-            ORDER BY c.customer_state, order_year, order_month;
-            """
+    st.markdown("---")
+
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.subheader("Top States by Avg Freight")
+        df_high_freight = (
+            get_state_aggregates()
+            .nlargest(5, 'avg_freight_value')[['customer_state', 'avg_freight_value']]
+            .reset_index(drop=True)
         )
-        if not df_mom_state.empty:
-            st.dataframe(df_mom_state, width='stretch')
+        if not df_high_freight.empty:
+            st.dataframe(
+                df_high_freight.style.format({
+                    'avg_freight_value': '${:,.2f}'
+                }).background_gradient(subset=['avg_freight_value'], cmap='Reds'),
+                width='stretch'
+            )
         else:
-            st.info("No month-on-month order data by state available.")
+            st.write("No data.")
 
-    # --- Economy ---
-    with tab_econ:
-        st.header("💰 Economic Analysis")
-        logger.info("Rendering Economy tab")
-        
-        st.subheader("Cost Increase: 2017 → 2018 (Jan–Aug)")
-        df_cost = run_query(
+    with col2:
+        st.subheader("Fastest vs Slowest Delivery")
+        # One per-state aggregate, sliced both ways
+        df_delivery_by_state = run_query(
             """
-            WITH OrderCosts AS (
-                SELECT
-                    EXTRACT(year FROM o.order_purchase_timestamp) AS order_year,
-                    SUM(p.payment_value) AS total_cost
-                FROM orders o
-                INNER JOIN payments p ON o.order_id = p.order_id
-                WHERE EXTRACT(year FROM o.order_purchase_timestamp) IN (2017, 2018)
-                  AND EXTRACT(month FROM o.order_purchase_timestamp) BETWEEN 1 AND 8
-                GROUP BY order_year
-            )
             SELECT
-                (SELECT total_cost FROM OrderCosts WHERE order_year = 2018) AS cost_2018,
-                (SELECT total_cost FROM OrderCosts WHERE order_year = 2017) AS cost_2017,
-                ROUND(
-                    (
-                        (SELECT total_cost FROM OrderCosts WHERE order_year = 2018) -
-                        (SELECT total_cost FROM OrderCosts WHERE order_year = 2017)
-                    ) * 100.0 /
-                    (SELECT total_cost FROM OrderCosts WHERE order_year = 2017),
-                    2
-                ) AS percentage_increase;
-            """
+                c.customer_state,
+                AVG(date_diff('day', o.order_purchase_timestamp, o.order_delivered_customer_date)) AS avg_delivery_time
+            FROM orders o
+            INNER JOIN customers c ON o.customer_id = c.customer_id
+            WHERE o.order_delivered_customer_date IS NOT NULL
+            GROUP BY c.customer_state;
+            """,
+            as_pandas=True,
         )
+        df_slowest = df_delivery_by_state.nlargest(5, 'avg_delivery_time').reset_index(drop=True)
+        df_fastest = df_delivery_by_state.nsmallest(5, 'avg_delivery_time').reset_index(drop=True)
         
-        if not df_cost.empty:
-            cost_2017 = df_cost.at[0, 'cost_2017'] if not pd.isna(df_cost.at[0, 'cost_2017']) else 0
-            cost_2018 = df_cost.at[0, 'cost_2018'] if not pd.isna(df_cost.at[0, 'cost_2018']) else 0
-            pct_increase = df_cost.at[0, 'percentage_increase'] if not pd.isna(df_cost.at[0, 'percentage_increase']) else 0
-
-            # Custom Metric Cards for Cost Analysis
-            c1, c2, c3 = st.columns(3)
-            with c1:
-                st.markdown(f"""
-                <div class="metric-container" style='background: linear-gradient(135deg, rgba(102, 126, 234, 0.15), rgba(102, 126, 234, 0.05));'>
-                    <div class="metric-icon" style="color: #667eea;">📉</div>
-                    <div class="metric-value">${cost_2017:,.2f}</div>
-                    <div class="metric-label">Total Cost 2017 (Jan-Aug)</div>
-                </div>
-                """, unsafe_allow_html=True)
-            with c2:
-                st.markdown(f"""
-                <div class="metric-container" style='background: linear-gradient(135deg, rgba(244, 114, 182, 0.15), rgba(244, 114, 182, 0.05));'>
-                    <div class="metric-icon" style="color: #f472b6;">📈</div>
-                    <div class="metric-value">${cost_2018:,.2f}</div>
-                    <div class="metric-label">Total Cost 2018 (Jan-Aug)</div>
-                </div>
-                """, unsafe_allow_html=True)
-            with c3:
-                st.markdown(f"""
-                <div class="metric-container" style='background: linear-gradient(135deg, rgba(56, 239, 125, 0.15), rgba(56, 239, 125, 0.05));'>
-                    <div class="metric-icon" style="color: #38ef7d;">🚀</div>
-                    <div class="metric-value">{pct_increase:.2f}%</div>
-                    <div class="metric-label">Increase Percentage</div>
-                </div>
-                """, unsafe_allow_html=True)
-        else:
-            st.info("No cost data available for 2017-2018 comparison.")
-
-        st.markdown("---")
-        
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            st.subheader("Order Price by State")
-            df_price_state = run_query(
-                """
-                SELECT
-                    c.customer_state,
-                    SUM(oi.price) AS total_order_price,
-                    AVG(oi.price) AS avg_order_price
-                FROM orders o
-                INNER JOIN customers c ON o.customer_id = c.customer_id
-                INNER JOIN order_items oi ON o.order_id = oi.order_id
-                GROUP BY c.customer_state
-                ORDER BY total_order_price DESC;
-                """
-            )
-            if not df_price_state.empty:
+        tab1, tab2 = st.tabs(["🐢 Slowest States", "🐇 Fastest States"])
+        with tab1:
+            if not df_slowest.empty:
                 st.dataframe(
-                    df_price_state.style.format({
-                        'total_order_price': '${:,.2f}',
-                        'avg_order_price': '${:,.2f}'
-                    }).background_gradient(subset=['total_order_price'], cmap='Blues'),
-                    width='stretch',
-                    height=400
+                    df_slowest.style.format({'avg_delivery_time': '{:.1f} days'})
+                    .background_gradient(subset=['avg_delivery_time'], cmap='Oranges'),
+                    width='stretch'
                 )
             else:
                 st.write("No data.")
-            
-        with col2:
-            st.subheader("Freight Value by State")
-            df_freight_state = run_query(
-                """
-                SELECT
-                    c.customer_state,
-                    SUM(oi.freight_value) AS total_freight_value,
-                    AVG(oi.freight_value) AS avg_freight_value
-                FROM orders o
-                INNER JOIN customers c ON o.customer_id = c.customer_id
-                INNER JOIN order_items oi ON o.order_id = oi.order_id
-                GROUP BY c.customer_state
-                ORDER BY total_freight_value DESC;
-                """
-            )
-            if not df_freight_state.empty:
+        with tab2:
+            if not df_fastest.empty:
                 st.dataframe(
-                    df_freight_state.style.format({
-                        'total_freight_value': '${:,.2f}',
-                        'avg_freight_value': '${:,.2f}'
-                    }).background_gradient(subset=['total_freight_value'], cmap='Reds'),
-                    width='stretch',
-                    height=400
+                    df_fastest.style.format({'avg_delivery_time': '{:.1f} days'})
+                    .background_gradient(subset=['avg_delivery_time'], cmap='Greens_r'),
+                    width='stretch'
                 )
             else:
                 st.write("No data.")
 
-    # --- Delivery & Freight ---
-    with tab_delivery:
-        st.header("🚚 Delivery & Freight Analysis")
-        logger.info("Rendering Delivery & Freight tab")
-        
-        st.subheader("Delivery Time vs Estimated")
-        df_delivery = run_query(
+@st.fragment
+def render_payments() -> None:
+    """Payment methods over time and installments."""
+    st.header("💳 Payment Analysis")
+    log_tab_render("Payments")
+    
+    col1, col2 = st.columns([1.5, 1])
+    
+    with col1:
+        st.subheader("Monthly Orders by Payment Type")
+        df_pay_month = run_query(
             """
+            -- Dedupe (order, payment type) once, so each group is a plain
+            -- COUNT(*) rather than a per-group distinct hash set
+            WITH order_payment_types AS (
+                SELECT DISTINCT order_id, payment_type
+                FROM payments
+            )
             SELECT
-                date_diff('day', order_purchase_timestamp, order_delivered_customer_date) AS time_to_deliver,
-                date_diff('day', order_delivered_customer_date, order_estimated_delivery_date) AS diff_estimated_delivery
-            FROM orders
-            WHERE order_delivered_customer_date IS NOT NULL
-              AND order_estimated_delivery_date IS NOT NULL;
+                o.order_year,
+                o.order_month,
+                p.payment_type,
+                COUNT(*) AS order_count,
+                printf('%d-%02d', o.order_year, o.order_month) AS year_month
+            FROM orders o
+            INNER JOIN order_payment_types p ON o.order_id = p.order_id
+            GROUP BY order_year, order_month, p.payment_type
+            ORDER BY order_year, order_month, p.payment_type;
             """
         )
         
-        if not df_delivery.empty:
-            # Plotly Histogram for Delivery Time
-            fig = px.histogram(df_delivery, x='time_to_deliver', nbins=50,
-                               title='Distribution of Delivery Times (Days)',
-                               color_discrete_sequence=['#8b5cf6'])
+        if df_pay_month.num_rows:
+            # Plotly Stacked Bar Chart
+            fig = px.bar(df_pay_month, x='year_month', y='order_count', color='payment_type',
+                         title='Payment Methods Over Time',
+                         labels={'year_month': 'Month', 'order_count': 'Orders', 'payment_type': 'Method'})
             fig.update_layout(
-                plot_bgcolor='rgba(0,0,0,0)',
-                paper_bgcolor='rgba(0,0,0,0)',
-                font=dict(color='#cbd5e1'),
-                xaxis=dict(showgrid=False, title='Days to Deliver'),
-                yaxis=dict(showgrid=True, gridcolor='rgba(255,255,255,0.1)', title='Count'),
-                bargap=0.1
+                legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
             )
             st.plotly_chart(fig, width='stretch')
         else:
-            st.info("No delivery time data available.")
+            st.info("No payment data available.")
 
-        st.markdown("---")
-
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            st.subheader("Top States by Avg Freight")
-            df_high_freight = run_query(
-                """
-                SELECT
-                    customer_state,
-                    AVG(freight_value) AS avg_freight_value
-                FROM (
-                    SELECT
-                        c.customer_state,
-                        oi.freight_value
-                    FROM orders o
-                    INNER JOIN customers c ON o.customer_id = c.customer_id
-                    INNER JOIN order_items oi ON o.order_id = oi.order_id
-                )
-                GROUP BY customer_state
-                ORDER BY avg_freight_value DESC
-                LIMIT 5;
-                """
-            )
-            if not df_high_freight.empty:
-                st.dataframe(
-                    df_high_freight.style.format({
-                        'avg_freight_value': '${:,.2f}'
-                    }).background_gradient(subset=['avg_freight_value'], cmap='Reds'),
-                    width='stretch'
-                )
-            else:
-                st.write("No data.")
-
-        with col2:
-            st.subheader("Fastest vs Slowest Delivery")
-            df_slowest = run_query(
-                """
-                SELECT
-                    customer_state,
-                    AVG(delivery_days) AS avg_delivery_time
-                FROM (
-                    SELECT
-                        c.customer_state,
-                        date_diff('day', o.order_purchase_timestamp, o.order_delivered_customer_date) AS delivery_days
-                    FROM orders o
-                    INNER JOIN customers c ON o.customer_id = c.customer_id
-                    WHERE o.order_delivered_customer_date IS NOT NULL
-                )
-                GROUP BY customer_state
-                ORDER BY avg_delivery_time DESC
-                LIMIT 5;
-                """
-            )
-            df_fastest = run_query(
-                """
-                SELECT
-                    customer_state,
-                    AVG(delivery_days) AS avg_delivery_time
-                FROM (
-                    SELECT
-                        c.customer_state,
-                        date_diff('day', o.order_purchase_timestamp, o.order_delivered_customer_date) AS delivery_days
-                    FROM orders o
-                    INNER JOIN customers c ON o.customer_id = c.customer_id
-                    WHERE o.order_delivered_customer_date IS NOT NULL
-                )
-                GROUP BY customer_state
-                ORDER BY avg_delivery_time ASC
-                LIMIT 5;
-                """
+    with col2:
+        st.subheader("Installments Distribution")
+        df_inst = run_query(
+            """
+            SELECT
+                payment_installments,
+                COUNT(*) AS order_count
+            FROM (
+                SELECT DISTINCT order_id, payment_installments
+                FROM payments
             )
-            
-            tab1, tab2 = st.tabs(["🐢 Slowest States", "🐇 Fastest States"])
-            with tab1:
-                if not df_slowest.empty:
-                    st.dataframe(
-                        df_slowest.style.format({'avg_delivery_time': '{:.1f} days'})
-                        .background_gradient(subset=['avg_delivery_time'], cmap='Oranges'),
-                        width='stretch'
-                    )
-                else:
-                    st.write("No data.")
-            with tab2:
-                if not df_fastest.empty:
-                    st.dataframe(
-                        df_fastest.style.format({'avg_delivery_time': '{:.1f} days'})
-                        .background_gradient(subset=['avg_delivery_time'], cmap='Greens_r'),
-                        width='stretch'
-                    )
-                else:
-                    st.write("No data.")
-
-    # --- Payments ---
-    with tab_pay:
-        st.header("💳 Payment Analysis")
-        logger.info("Rendering Payments tab")
+            GROUP BY payment_installments
+            ORDER BY payment_installments;
+            """
+        )
         
-        col1, col2 = st.columns([1.5, 1])
+        if df_inst.num_rows:
+            # Plotly Bar Chart
+            fig = px.bar(df_inst, x='payment_installments', y='order_count',
+                         title='Orders by Installments')
+            fig.update_traces(marker_color=rank_colors(df_inst['order_count'], 'Magma'))
+            fig.update_layout(
+                xaxis_title='Installments',
+                yaxis_title='Orders'
+            )
+            st.plotly_chart(fig, width='stretch')
+        else:
+            st.write("No data.")
         
-        with col1:
-            st.subheader("Monthly Orders by Payment Type")
-            df_pay_month = run_query(
+    st.markdown("---")
+    if df_pay_month.num_rows:
+        st.dataframe(df_pay_month, width='stretch')
+
+@st.fragment
+def render_products() -> None:
+    """Top products, review scores and product stats."""
+    st.header("⭐ Products & Reviews")
+    log_tab_render("Products & Reviews")
+    
+    col1, col2 = st.columns([1.5, 1])
+    
+    with col1:
+        st.subheader("Top 10 Product Categories")
+        try:
+            df_prod = run_query(
                 """
                 SELECT
-                    EXTRACT(year  FROM o.order_purchase_timestamp) AS order_year,
-                    EXTRACT(month FROM o.order_purchase_timestamp) AS order_month,
-                    p.payment_type,
-                    COUNT(DISTINCT o.order_id) AS order_count
-                FROM orders o
-                INNER JOIN payments p ON o.order_id = p.order_id
-                GROUP BY order_year, order_month, p.payment_type
-                ORDER BY order_year, order_month, p.payment_type;
+                    p."product category" AS product_category_name,
+                    COUNT(oi.order_item_id) AS total_items_sold,
+                    SUM(oi.price) AS total_revenue
+                FROM order_items oi
+                INNER JOIN products p ON oi.product_id = p.product_id
+                WHERE p."product category" IS NOT NULL
+                GROUP BY p."product category"
+                ORDER BY total_items_sold DESC
+                LIMIT 10;
                 """
             )
             
-            if not df_pay_month.empty:
-                df_pay_month["year_month"] = (
-                    df_pay_month["order_year"].astype(int).astype(str)
-                    + "-"
-                    + df_pay_month["order_month"].astype(int).astype(str).str.zfill(2)
-                )
-                
-                # Plotly Stacked Bar Chart
-                fig = px.bar(df_pay_month, x='year_month', y='order_count', color='payment_type',
-                             title='Payment Methods Over Time',
-                             labels={'year_month': 'Month', 'order_count': 'Orders', 'payment_type': 'Method'})
+            if df_prod.num_rows:
+                # Plotly Bar Chart
+                fig = px.bar(df_prod, x='total_items_sold', y='product_category_name', orientation='h',
+                             title='Top Product Categories by Sales Volume')
+                fig.update_traces(marker_color=rank_colors(df_prod['total_revenue'], 'Plasma'))
                 fig.update_layout(
-                    plot_bgcolor='rgba(0,0,0,0)',
-                    paper_bgcolor='rgba(0,0,0,0)',
-                    font=dict(color='#cbd5e1'),
-                    xaxis=dict(showgrid=False),
-                    yaxis=dict(showgrid=True, gridcolor='rgba(255,255,255,0.1)'),
-                    legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+                    xaxis=dict(showgrid=True, title='Items Sold'),
+                    yaxis=dict(showgrid=False, title='Category', categoryorder='total ascending'),
+                    height=500
                 )
                 st.plotly_chart(fig, width='stretch')
             else:
-                st.info("No payment data available.")
+                st.info("No product sales data available.")
+        except Exception as e:
+            st.error(f"Error loading product data: {str(e)}")
+            logger.error(f"Product query error: {e}")
 
-        with col2:
-            st.subheader("Installments Distribution")
-            df_inst = run_query(
+    with col2:
+        st.subheader("Review Score Distribution")
+        try:
+            df_reviews = run_query(
                 """
+                WITH counts AS (
+                    SELECT
+                        review_score,
+                        COUNT(*) AS review_count
+                    FROM reviews
+                    WHERE review_score IS NOT NULL
+                    GROUP BY review_score
+                )
                 SELECT
-                    payment_installments,
-                    COUNT(DISTINCT order_id) AS order_count
-                FROM payments
-                GROUP BY payment_installments
-                ORDER BY payment_installments;
-                """
+                    review_score,
+                    review_count,
+                    ROUND(review_count * 100.0 / SUM(review_count) OVER (), 2) AS percentage
+                FROM counts
+                ORDER BY review_score DESC;
+                """,
+                as_pandas=True,
             )
             
-            if not df_inst.empty:
-                # Plotly Bar Chart
-                fig = px.bar(df_inst, x='payment_installments', y='order_count',
-                             title='Orders by Installments',
-                             color='order_count', color_continuous_scale='Magma')
+            if not df_reviews.empty:
+                # Plotly Donut Chart
+                fig = px.pie(df_reviews, values='review_count', names='review_score',
+                             title='Review Scores Distribution',
+                             color_discrete_sequence=px.colors.sequential.RdBu,
+                             hole=0.4)
                 fig.update_layout(
-                    plot_bgcolor='rgba(0,0,0,0)',
-                    paper_bgcolor='rgba(0,0,0,0)',
-                    font=dict(color='#cbd5e1'),
-                    xaxis=dict(showgrid=False, title='Installments'),
-                    yaxis=dict(showgrid=True, gridcolor='rgba(255,255,255,0.1)', title='Orders')
+                    showlegend=True
                 )
+                fig.update_traces(textposition='inside', textinfo='percent+label')
                 st.plotly_chart(fig, width='stretch')
-            else:
-                st.write("No data.")
-            
-        st.markdown("---")
-        if not df_pay_month.empty:
-            st.dataframe(df_pay_month, width='stretch')
-
-    # --- Products & Reviews ---
-    with tab_prod:
-        st.header("⭐ Products & Reviews")
-        logger.info("Rendering Products & Reviews tab")
-        
-        col1, col2 = st.columns([1.5, 1])
-        
-        with col1:
-            st.subheader("Top 10 Product Categories")
-            try:
-                df_prod = run_query(
-                    """
-                    SELECT
-                        COUNT(oi.order_item_id) AS total_items_sold,
-                        SUM(oi.price) AS total_revenue
-                    FROM order_items oi
-                    INNER JOIN products p ON oi.product_id = p.product_id
-                    GROUP BY p.product_id
-                    ORDER BY total_items_sold DESC
-                    LIMIT 10;
-                    """
-                )
                 
-                if not df_prod.empty and len(df_prod) > 0:
-                    # Plotly Bar Chart
-                    fig = px.bar(df_prod, x='total_items_sold', y=df_prod.index, orientation='h',
-                                 title='Top Products by Sales Volume',
-                                 color='total_revenue', color_continuous_scale='Plasma')
-                    fig.update_layout(
-                        plot_bgcolor='rgba(0,0,0,0)',
-                        paper_bgcolor='rgba(0,0,0,0)',
-                        font=dict(color='#cbd5e1'),
-                        xaxis=dict(showgrid=True, gridcolor='rgba(255,255,255,0.1)', title='Items Sold'),
-                        yaxis=dict(showgrid=False, title='Product Rank', categoryorder='total ascending'),
-                        height=500
-                    )
-                    st.plotly_chart(fig, width='stretch')
-                else:
-                    st.info("No product sales data available.")
-            except Exception as e:
-                st.error(f"Error loading product data: {str(e)}")
-                logger.error(f"Product query error: {e}")
-
-        with col2:
-            st.subheader("Review Score Distribution")
-            try:
-                df_reviews = run_query(
-                    """
-                    WITH counts AS (
-                        SELECT
-                            review_score,
-                            COUNT(*) AS review_count
-                        FROM reviews
-                        WHERE review_score IS NOT NULL
-                        GROUP BY review_score
-                    )
-                    SELECT
-                        review_score,
-                        review_count,
-                        ROUND(review_count * 100.0 / SUM(review_count) OVER (), 2) AS percentage
-                    FROM counts
-                    ORDER BY review_score DESC;
-                    """
+                # Display styled dataframe
+                st.dataframe(
+                    df_reviews.style.format({
+                        'percentage': '{:.2f}%',
+                        'review_count': '{:,}'
+                    }).background_gradient(subset=['review_count'], cmap='RdYlGn'),
+                    width='stretch'
                 )
-                
-                if not df_reviews.empty:
-                    # Plotly Donut Chart
-                    fig = px.pie(df_reviews, values='review_count', names='review_score',
-                                 title='Review Scores Distribution',
-                                 color_discrete_sequence=px.colors.sequential.RdBu,
-                                 hole=0.4)
-                    fig.update_layout(
-                        plot_bgcolor='rgba(0,0,0,0)',
-                        paper_bgcolor='rgba(0,0,0,0)',
-                        font=dict(color='#cbd5e1'),
-                        showlegend=True
-                    )
-                    fig.update_traces(textposition='inside', textinfo='percent+label')
-                    st.plotly_chart(fig, width='stretch')
-                    
-                    # Display styled dataframe
-                    st.dataframe(
-                        df_reviews.style.format({
-                            'percentage': '{:.2f}%',
-                            'review_count': '{:,}'
-                        }).background_gradient(subset=['review_count'], cmap='RdYlGn'),
-                        width='stretch'
-                    )
-                else:
-                    st.write("No review data.")
-            except Exception as e:
-                st.error(f"Error loading review data: {str(e)}")
-                logger.error(f"Review query error: {e}")
-            
-        st.markdown("---")
-        
-        # Additional Product Insights
-        st.subheader("📦 Product Performance Metrics")
-        try:
-            df_prod_stats = run_query(
-                """
-                SELECT
-                    COUNT(DISTINCT oi.product_id) AS unique_products,
-                    COUNT(oi.order_item_id) AS total_items_sold,
-                    ROUND(AVG(oi.price), 2) AS avg_price,
-                    ROUND(SUM(oi.price), 2) AS total_revenue
-                FROM order_items oi;
-                """
-            )
-            
-            if not df_prod_stats.empty:
-                m1, m2, m3, m4 = st.columns(4)
-                with m1:
-                    st.markdown(f"""
-                    <div class="metric-container" style='background: linear-gradient(135deg, rgba(102, 126, 234, 0.15), rgba(102, 126, 234, 0.05));'>
-                        <div class="metric-icon" style="color: #667eea;">📦</div>
-                        <div class="metric-value">{int(df_prod_stats.at[0, 'unique_products']):,}</div>
-                        <div class="metric-label">Unique Products</div>
-                    </div>
-                    """, unsafe_allow_html=True)
-                with m2:
-                    st.markdown(f"""
-                    <div class="metric-container" style='background: linear-gradient(135deg, rgba(244, 114, 182, 0.15), rgba(244, 114, 182, 0.05));'>
-                        <div class="metric-icon" style="color: #f472b6;">🛒</div>
-                        <div class="metric-value">{int(df_prod_stats.at[0, 'total_items_sold']):,}</div>
-                        <div class="metric-label">Items Sold</div>
-                    </div>
-                    """, unsafe_allow_html=True)
-                with m3:
-                    st.markdown(f"""
-                    <div class="metric-container" style='background: linear-gradient(135deg, rgba(56, 239, 125, 0.15), rgba(56, 239, 125, 0.05));'>
-                        <div class="metric-icon" style="color: #38ef7d;">💵</div>
-                        <div class="metric-value">${float(df_prod_stats.at[0, 'avg_price']):,.2f}</div>
-                        <div class="metric-label">Avg Price</div>
-                    </div>
-                    """, unsafe_allow_html=True)
-                with m4:
-                    st.markdown(f"""
-                    <div class="metric-container" style='background: linear-gradient(135deg, rgba(251, 146, 60, 0.15), rgba(251, 146, 60, 0.05));'>
-                        <div class="metric-icon" style="color: #fb923c;">💰</div>
-                        <div class="metric-value">${float(df_prod_stats.at[0, 'total_revenue']):,.0f}</div>
-                        <div class="metric-label">Total Revenue</div>
-                    </div>
-                    """, unsafe_allow_html=True)
+            else:
+                st.write("No review data.")
         except Exception as e:
-            st.error(f"Error loading product statistics: {str(e)}")
-            logger.error(f"Product stats error: {e}")
-
-    # --- Raw Tables ---
-    with tab_raw:
-        st.header("📋 Raw Data Explorer")
-        logger.info("Rendering Raw Tables tab")
+            st.error(f"Error loading review data: {str(e)}")
+            logger.error(f"Review query error: {e}")
         
-        st.markdown("""
-        <div style='background: rgba(139, 92, 246, 0.1); padding: 1rem; border-radius: 10px; border: 1px solid rgba(139, 92, 246, 0.3); margin-bottom: 1rem;'>
-            <p style='margin: 0; color: #cbd5e1;'>
-                🔍 <strong>Explore the raw data tables</strong> from the Target Brazil E-Commerce dataset. 
-                Select a table below to preview up to 500 rows.
+    st.markdown("---")
+    
+    # Additional Product Insights
+    st.subheader("📦 Product Performance Metrics")
+    try:
+        prod_stats = run_scalar_query(
+            """
+            SELECT
+                COUNT(DISTINCT oi.product_id) AS unique_products,
+                COUNT(oi.order_item_id) AS total_items_sold,
+                ROUND(AVG(oi.price), 2) AS avg_price,
+                ROUND(SUM(oi.price), 2) AS total_revenue
+            FROM order_items oi;
+            """
+        )
+        
+        if prod_stats is not None:
+            unique_products, items_sold, avg_price, total_revenue = prod_stats
+            metric_grid([
+                metric_html("📦", "#667eea", f"{int(unique_products):,}", "Unique Products"),
+                metric_html("🛒", "#f472b6", f"{int(items_sold):,}", "Items Sold"),
+                metric_html("💵", "#38ef7d", f"${float(avg_price):,.2f}", "Avg Price"),
+                metric_html("💰", "#fb923c", f"${float(total_revenue):,.0f}", "Total Revenue"),
+            ], columns=4)
+    except Exception as e:
+        st.error(f"Error loading product statistics: {str(e)}")
+        logger.error(f"Product stats error: {e}")
+
+@st.fragment
+def render_raw_tables() -> None:
+    """Preview and download of the loaded tables."""
+    st.header("📋 Raw Data Explorer")
+    log_tab_render("Raw Tables")
+    
+    st.markdown("""
+    <div style='background: rgba(139, 92, 246, 0.1); padding: 1rem; border-radius: 10px; border: 1px solid rgba(139, 92, 246, 0.3); margin-bottom: 1rem;'>
+        <p style='margin: 0; color: #cbd5e1;'>
+            🔍 <strong>Explore the raw data tables</strong> from the Target Brazil E-Commerce dataset. 
+            Select a table below to preview up to 500 rows.
+        </p>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    col1, col2 = st.columns([1, 3])
+    
+    table_options = ["customers", "sellers", "order_items", "geolocation", "payments", "reviews", "orders", "products"]
+    
+    with col1:
+        selected_option = st.selectbox(
+            "📊 Select Table",
+            ["ALL TABLES"] + table_options,
+            index=0
+        )
+    
+    with col2:
+        st.markdown(f"""
+        <div style='background: rgba(244, 114, 182, 0.1); padding: 0.8rem; border-radius: 8px; border: 1px solid rgba(244, 114, 182, 0.3);'>
+            <p style='margin: 0; color: #f472b6; font-weight: 600;'>
+                Currently viewing: <span style='color: #fff;'>{selected_option}</span>
             </p>
         </div>
         """, unsafe_allow_html=True)
-        
-        col1, col2 = st.columns([1, 3])
-        
-        table_options = ["customers", "sellers", "order_items", "geolocation", "payments", "reviews", "orders", "products"]
-        
-        with col1:
-            selected_option = st.selectbox(
-                "📊 Select Table",
-                ["ALL TABLES"] + table_options,
-                index=0
-            )
-        
-        with col2:
-            st.markdown(f"""
-            <div style='background: rgba(244, 114, 182, 0.1); padding: 0.8rem; border-radius: 8px; border: 1px solid rgba(244, 114, 182, 0.3);'>
-                <p style='margin: 0; color: #f472b6; font-weight: 600;'>
-                    Currently viewing: <span style='color: #fff;'>{selected_option}</span>
-                </p>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        st.markdown("<br>", unsafe_allow_html=True)
-        
-        tables_to_show = table_options if selected_option == "ALL TABLES" else [selected_option]
-        
-        for table in tables_to_show:
-            if selected_option == "ALL TABLES":
-                st.markdown(f"### 📄 {table}")
+    
+    st.markdown("<br>", unsafe_allow_html=True)
+    
+    tables_to_show = table_options if selected_option == "ALL TABLES" else [selected_option]
+    
+    for table in tables_to_show:
+        # Collapsed expanders skip the query and table render until opened
+        expander = st.expander(
+            f"📄 {table}",
+            expanded=selected_option != "ALL TABLES",
+            key=f"raw_expander_{table}",
+            on_change="rerun",
+        )
+        with expander:
+            if not expander.open:
+                continue
             
             try:
-                df_raw = run_query(f"SELECT * FROM {table} LIMIT 500;")
-                
-                if not df_raw.empty:
+                # Preview the Parquet copy so every column is shown, not only
+                # the ones loaded into DuckDB for the analysis queries
+                preview_sql = f"SELECT * FROM read_parquet('{parquet_path(table).as_posix()}') LIMIT 500;"
+                df_raw = run_query(preview_sql)
+            
+                if df_raw.num_rows:
                     # Display table info
-                    info_col1, info_col2, info_col3 = st.columns(3)
-                    with info_col1:
-                        st.markdown(f"""
-                        <div class="metric-container" style='background: linear-gradient(135deg, rgba(102, 126, 234, 0.15), rgba(102, 126, 234, 0.05));'>
-                            <div class="metric-icon" style="color: #667eea;">📊</div>
-                            <div class="metric-value">{len(df_raw):,}</div>
-                            <div class="metric-label">Rows Shown</div>
-                        </div>
-                        """, unsafe_allow_html=True)
-                    with info_col2:
-                        st.markdown(f"""
-                        <div class="metric-container" style='background: linear-gradient(135deg, rgba(244, 114, 182, 0.15), rgba(244, 114, 182, 0.05));'>
-                            <div class="metric-icon" style="color: #f472b6;">📋</div>
-                            <div class="metric-value">{len(df_raw.columns)}</div>
-                            <div class="metric-label">Columns</div>
-                        </div>
-                        """, unsafe_allow_html=True)
-                    with info_col3:
-                        st.markdown(f"""
-                        <div class="metric-container" style='background: linear-gradient(135deg, rgba(56, 239, 125, 0.15), rgba(56, 239, 125, 0.05));'>
-                            <div class="metric-icon" style="color: #38ef7d;">💾</div>
-                            <div class="metric-value">{df_raw.memory_usage(deep=True).sum() / 1024:.1f} KB</div>
-                            <div class="metric-label">Memory Usage</div>
-                        </div>
-                        """, unsafe_allow_html=True)
-                    
+                    metric_grid([
+                        metric_html("📊", "#667eea", f"{df_raw.num_rows:,}", "Rows Shown"),
+                        metric_html("📋", "#f472b6", f"{df_raw.num_columns}", "Columns"),
+                        metric_html("💾", "#38ef7d", f"{df_raw.nbytes / 1024:.1f} KB", "Memory Usage"),
+                    ])
+                
                     st.markdown("<br>", unsafe_allow_html=True)
-                    
+                
                     # Display the dataframe
                     st.dataframe(df_raw, width='stretch', height=400 if selected_option == "ALL TABLES" else 600)
-                    
-                    # Download button
-                    csv = df_raw.to_csv(index=False).encode('utf-8')
+                
+                    # Download button; the CSV is only encoded when clicked
                     st.download_button(
                         label=f"📥 Download {table} as CSV",
-                        data=csv,
+                        data=partial(query_csv_bytes, preview_sql),
                         file_name=f"{table}_export.csv",
                         mime="text/csv",
-                        key=f"download_{table}"
+                        key=f"download_{table}",
+                        on_click="ignore"
                     )
-                    
-                    if selected_option == "ALL TABLES":
-                        st.markdown("---")
-                        
+
                 else:
                     st.warning(f"No data found in table: {table}")
             except Exception as e:
                 st.error(f"Error loading table data for {table}: {str(e)}")
                 logger.error(f"Raw table query error for {table}: {e}")
 
-
-    # --- Activity Log ---
-    with tab_log:
-        st.header("📝 Application Activity Log")
+@st.fragment
+def render_activity_log() -> None:
+    """This session's log entries."""
+    st.header("📝 Application Activity Log")
+    
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        st.markdown("Track all application events, data queries, and user interactions.")
+    with col2:
+        # Cleared in the callback, before the section reruns, so the click
+        # only reruns this fragment and the log below is already empty
+        st.button("🗑️ Clear Logs", on_click=st.session_state['log_data'].clear)
+    
+    if st.session_state['log_data']:
+        # Display logs in a text area, newest first like the table below
+        log_text = "\n".join(reversed(st.session_state['log_data']))
+        st.text_area("System Logs", value=log_text, height=300, disabled=True)
         
-        col1, col2 = st.columns([3, 1])
-        with col1:
-            st.markdown("Track all application events, data queries, and user interactions.")
-        with col2:
-            if st.button("🗑️ Clear Logs"):
-                st.session_state['log_data'] = []
-                st.rerun()
+        st.markdown("---")
         
-        if st.session_state['log_data']:
-            # Display logs in a text area
-            log_text = "\n".join(st.session_state['log_data'])
-            st.text_area("System Logs", value=log_text, height=300, disabled=True)
-            
-            st.markdown("---")
+        # Also show as a dataframe for better filtering
+        try:
+            # Parse logs into a dataframe in one vectorized split, assuming the
+            # format: '%(asctime)s - %(levelname)s - %(message)s'. Built from
+            # the reversed deque so the newest entry is already first.
+            logs = pd.Series(list(reversed(st.session_state['log_data'])), dtype=object)
+            parts = logs.str.split(' - ', n=2, expand=True).reindex(columns=range(3))
+            # Lines that don't match the format are kept whole as INFO messages
+            well_formed = parts[2].notna()
+            df_logs = pd.DataFrame({
+                'Timestamp': parts[0].where(well_formed, ''),
+                'Level': parts[1].where(well_formed, 'INFO'),
+                'Message': parts[2].where(well_formed, logs).str.strip(),
+            })
             
-            # Also show as a dataframe for better filtering
-            try:
-                # Parse logs into a dataframe
-                log_entries = []
-                for entry in st.session_state['log_data']:
-                    # Simple parsing assuming the format: '%(asctime)s - %(levelname)s - %(message)s'
-                    parts = entry.split(' - ', 2)
-                    if len(parts) == 3:
-                        log_entries.append({
-                            'Timestamp': parts[0],
-                            'Level': parts[1],
-                            'Message': parts[2].strip()
-                        })
-                    else:
-                        log_entries.append({
-                            'Timestamp': '',
-                            'Level': 'INFO',
-                            'Message': entry.strip()
-                        })
+            if not df_logs.empty:
+                st.subheader("Log Table (Newest First)")
                 
-                if log_entries:
-                    df_logs = pd.DataFrame(log_entries)
-                    # Reverse order to show newest first
-                    df_logs = df_logs.iloc[::-1]
-                    
-                    st.subheader("Log Table (Newest First)")
-                    
-                    def color_level(val):
-                        color = '#10b981' # Green for INFO
-                        if val == 'ERROR':
-                            color = '#ef4444' # Red
-                        elif val == 'WARNING':
-                            color = '#f59e0b' # Amber
-                        return f'color: {color}; font-weight: bold;'
-                        
-                    st.dataframe(
-                        df_logs.style.map(color_level, subset=['Level']),
-                        width='stretch',
-                        height=400
-                    )
-            except Exception as e:
-                st.error(f"Error parsing logs: {e}")
-        else:
-            st.info("No activity logs recorded yet.")
+                st.dataframe(
+                    df_logs.style.apply(
+                        lambda levels: levels.map(LEVEL_STYLES).fillna(LEVEL_STYLES['INFO']),
+                        subset=['Level']
+                    ),
+                    width='stretch',
+                    height=400
+                )
+        except Exception as e:
+            st.error(f"Error parsing logs: {e}")
+    else:
+        st.info("No activity logs recorded yet.")
+
+# Navigation label -> section renderer
+SECTIONS = {
+    "Overview": render_overview,
+    "Orders & Trends": render_orders,
+    "Geography": render_geography,
+    "Economy": render_economy,
+    "Delivery & Freight": render_delivery,
+    "Payments": render_payments,
+    "Products & Reviews": render_products,
+    "Raw Tables": render_raw_tables,
+    "Activity Log": render_activity_log,
+}
 
 
 if __name__ == "__main__":